@@ -1,18 +1,41 @@
 from libridialogue.librispeech.download import download
 from libridialogue.librispeech.generate_csv import generate_librispeech_csvs
-from libridialogue.generate import generate
+from libridialogue.generate import generate, rate_label
+from libridialogue.rir_bank import build_rir_bank
 from libridialogue.util.separate_cosy import separate_cosy
 from libridialogue.util.separate_mossformer2 import separate_mossformer2
-from libridialogue.util.separate_asteroid import separate_asteroid
+from libridialogue.util.separate_asteroid import CONVTASNET_MODELS, separate_asteroid
 from libridialogue.util.analyze import analyze
+from libridialogue.manifest import merge_manifests, parse_shard
 from libridialogue import settings
+import argparse
 import os
 import shutil
 
 
-def run():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate, separate and analyze the LibriDialogue dataset"
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="only generate shard i of N of the pairs, e.g. 0/4",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        metavar="N",
+        help="merge the manifests of N generated shards, then separate and analyze",
+    )
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+
     print("Downloading LibriSpeech dataset...")
-    download(["test-clean"])
+    download(["test-clean"], extract=not settings.LIBRISPEECH_ARCHIVE)
 
     print("Generating CSV files...")
     generate_librispeech_csvs()
@@ -22,30 +45,56 @@ def run():
     libridialogue_path = settings.LIBRIDIALOGUE_PATH + "/test-clean"
     libridialogue_separated_path = settings.LIBRIDIALOGUE_SEPARATED_PATH + "/test-clean"
 
-    if settings.OVERWRITE_GENERATED_DATA:
-        print("Removing existing generated data...")
-        if os.path.exists(libridialogue_path):
-            shutil.rmtree(libridialogue_path)
-        if os.path.exists(libridialogue_separated_path):
-            shutil.rmtree(libridialogue_separated_path)
+    if args.merge:
+        print(f"Merging {args.merge} shards...")
+        merge_manifests(libridialogue_path, args.merge, settings.LIBRIDIALOGUE_SIZE)
+    else:
+        # nodes generating shards share the output directory
+        if settings.OVERWRITE_GENERATED_DATA and args.shard is None:
+            print("Removing existing generated data...")
+            # a resumed dataset keeps its completed pairs
+            if os.path.exists(libridialogue_path) and not settings.LIBRIDIALOGUE_RESUME:
+                shutil.rmtree(libridialogue_path)
+            if os.path.exists(libridialogue_separated_path):
+                shutil.rmtree(libridialogue_separated_path)
+
+        if settings.LIBRIDIALOGUE_RIR_BANK_PATH:
+            # nodes would race on the partial directory of the bank, it is built
+            # once before the shards are generated
+            if args.shard is not None:
+                if not os.path.exists(settings.LIBRIDIALOGUE_RIR_BANK_PATH):
+                    raise FileNotFoundError(
+                        f"RIR bank {settings.LIBRIDIALOGUE_RIR_BANK_PATH} does not "
+                        "exist, build it with python -m libridialogue.rir_bank "
+                        "before generating shards"
+                    )
+            else:
+                print("Building RIR bank...")
+                build_rir_bank()
+
+        print("Generating reverb-dual dataset...")
+        generate(
+            librispeech_path,
+            libridialogue_path,
+            settings.LIBRIDIALOGUE_SIZE,
+            shard=args.shard,
+        )
 
-    print("Generating reverb-dual dataset...")
-    generate(librispeech_path, libridialogue_path, settings.LIBRIDIALOGUE_SIZE)
+        if args.shard is not None:
+            print(f"Generated shard {args.shard[0]}/{args.shard[1]}")
+            return
 
     if settings.SEPARATE_COSY:
         print("Separating reverb-dual dataset with cosy...")
-        separate_cosy(
-            f"{libridialogue_path}/8k/reverb-dual",
-            f"{libridialogue_separated_path}/cosy-8k",
-            8000,
-        )
-        separate_cosy(
-            f"{libridialogue_path}/16k/reverb-dual",
-            f"{libridialogue_separated_path}/cosy-16k",
-            16000,
-        )
-
-    if settings.SEPARATE_MOSSFORMER2:
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            separate_cosy(
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-dual",
+                f"{libridialogue_separated_path}/cosy-{rate_label(rate)}",
+                rate,
+            )
+
+    # MossFormer2 is only available as 8k model
+    if settings.SEPARATE_MOSSFORMER2 and 8000 in settings.LIBRIDIALOGUE_SAMPLE_RATES:
         print("Separating reverb-dual dataset with moss...")
         separate_mossformer2(
             f"{libridialogue_path}/8k/reverb-dual",
@@ -55,69 +104,50 @@ def run():
 
     if settings.SEPARATE_CONVTASNET:
         print("Separating reverb-dual dataset with convtasnet...")
-        separate_asteroid(
-            f"{libridialogue_path}/8k/reverb-dual",
-            f"{libridialogue_separated_path}/convtasnet-8k",
-            8000,
-            model="JorisCos/ConvTasNet_Libri2Mix_sepnoisy_8k",
-        )
-        separate_asteroid(
-            f"{libridialogue_path}/16k/reverb-dual",
-            f"{libridialogue_separated_path}/convtasnet-16k",
-            16000,
-            model="JorisCos/ConvTasNet_Libri2Mix_sepnoisy_16k",
-        )
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            if rate not in CONVTASNET_MODELS:
+                print(f"No convtasnet model for {rate} Hz, skipping...")
+                continue
+            separate_asteroid(
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-dual",
+                f"{libridialogue_separated_path}/convtasnet-{rate_label(rate)}",
+                rate,
+                model=CONVTASNET_MODELS[rate],
+            )
 
     if settings.ANALYZE_CLEAN:
         print("Analyzing clean dataset...")
-        analyze(
-            f"{libridialogue_path}/8k/clean",
-            f"{libridialogue_path}/8k/reverb-solo",
-            librispeech_csv_path,
-            8000,
-            name="clean-8k",
-        )
-        analyze(
-            f"{libridialogue_path}/16k/clean",
-            f"{libridialogue_path}/16k/reverb-solo",
-            librispeech_csv_path,
-            16000,
-            name="clean-16k",
-        )
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            analyze(
+                f"{libridialogue_path}/{rate_label(rate)}/clean",
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-solo",
+                librispeech_csv_path,
+                rate,
+                name=f"clean-{rate_label(rate)}",
+            )
 
     if settings.ANALYZE_REVERB_DUAL:
         print("Analyzing reverb-dual dataset...")
-        analyze(
-            f"{libridialogue_path}/8k/reverb-dual",
-            f"{libridialogue_path}/8k/reverb-solo",
-            librispeech_csv_path,
-            8000,
-            name="reverb-dual-8k",
-        )
-        analyze(
-            f"{libridialogue_path}/16k/reverb-dual",
-            f"{libridialogue_path}/16k/reverb-solo",
-            librispeech_csv_path,
-            16000,
-            name="reverb-dual-16k",
-        )
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            analyze(
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-dual",
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-solo",
+                librispeech_csv_path,
+                rate,
+                name=f"reverb-dual-{rate_label(rate)}",
+            )
 
     if settings.ANALYZE_COSY:
         print("Analyzing cosy separated reverb-dual dataset...")
-        analyze(
-            f"{libridialogue_separated_path}/cosy-8k",
-            f"{libridialogue_path}/8k/reverb-solo",
-            librispeech_csv_path,
-            8000,
-        )
-        analyze(
-            f"{libridialogue_separated_path}/cosy-16k",
-            f"{libridialogue_path}/16k/reverb-solo",
-            librispeech_csv_path,
-            16000,
-        )
-
-    if settings.ANALYZE_MOSSFORMER2:
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            analyze(
+                f"{libridialogue_separated_path}/cosy-{rate_label(rate)}",
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-solo",
+                librispeech_csv_path,
+                rate,
+            )
+
+    if settings.ANALYZE_MOSSFORMER2 and 8000 in settings.LIBRIDIALOGUE_SAMPLE_RATES:
         print("Analyzing reverb-dual dataset separated by moss...")
         analyze(
             f"{libridialogue_separated_path}/mossformer2-8k",
@@ -128,18 +158,15 @@ def run():
 
     if settings.ANALYZE_CONVTASNET:
         print("Analyzing reverb-dual dataset separated by convtasnet...")
-        analyze(
-            f"{libridialogue_separated_path}/convtasnet-8k",
-            f"{libridialogue_path}/8k/reverb-solo",
-            librispeech_csv_path,
-            8000,
-        )
-        analyze(
-            f"{libridialogue_separated_path}/convtasnet-16k",
-            f"{libridialogue_path}/16k/reverb-solo",
-            librispeech_csv_path,
-            16000,
-        )
+        for rate in settings.LIBRIDIALOGUE_SAMPLE_RATES:
+            if rate not in CONVTASNET_MODELS:
+                continue
+            analyze(
+                f"{libridialogue_separated_path}/convtasnet-{rate_label(rate)}",
+                f"{libridialogue_path}/{rate_label(rate)}/reverb-solo",
+                librispeech_csv_path,
+                rate,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+import numpy as np
+from scipy import fft
+
+
+class BatchConvolver:
+    """
+    Vectorised FFT convolution of a batch of multi-source signals with a batch of
+    multichannel room impulse responses.
+    Long signals are convolved block-wise with overlap-add, the FFT sizes are
+    cached per impulse response length and the work buffers are reused between
+    calls with the same shapes.
+    """
+
+    def __init__(self, dtype=np.float32, block_size=None, workers=None):
+        self.dtype = np.dtype(dtype)
+        self.block_size = block_size
+        self.workers = workers
+        self._fft_sizes = {}
+        self._buffers = {}
+
+    def _fft_size(self, rir_length, signal_length):
+        key = (rir_length, signal_length)
+        if key not in self._fft_sizes:
+            if self.block_size is not None:
+                n_fft = fft.next_fast_len(self.block_size + rir_length - 1, real=True)
+            elif signal_length <= 4 * rir_length:
+                # Short signals are convolved with a single FFT
+                n_fft = fft.next_fast_len(signal_length + rir_length - 1, real=True)
+            else:
+                n_fft = fft.next_fast_len(8 * rir_length, real=True)
+            self._fft_sizes[key] = n_fft
+        return self._fft_sizes[key]
+
+    def _buffer(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=self.dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def convolve(self, signals, rirs, out=None):
+        """
+        Convolve every source signal with the room impulse responses to every
+        microphone
+
+        Args:
+        - signals (np.ndarray): (batch, sources, samples)
+        - rirs (np.ndarray): (batch, mics, sources, rir_samples)
+        - out (np.ndarray): Optional output array of the result shape
+
+        Returns:
+        - np.ndarray: (batch, mics, sources, samples + rir_samples - 1), the
+          per-source images at each microphone
+        """
+        signals = np.asarray(signals, dtype=self.dtype)
+        rirs = np.asarray(rirs, dtype=self.dtype)
+        batch, sources, signal_length = signals.shape
+        _, mics, _, rir_length = rirs.shape
+        out_length = signal_length + rir_length - 1
+
+        n_fft = self._fft_size(rir_length, signal_length)
+        block_size = n_fft - rir_length + 1
+        num_blocks = -(-signal_length // block_size)
+
+        # Split the signals into blocks, the last block is zero padded
+        blocks = self._buffer("blocks", (batch, sources, num_blocks * block_size))
+        blocks[..., :signal_length] = signals
+        blocks[..., signal_length:] = 0
+        blocks = blocks.reshape(batch, sources, num_blocks, block_size)
+
+        signal_spectra = fft.rfft(blocks, n_fft, axis=-1, workers=self.workers)
+        rir_spectra = fft.rfft(rirs, n_fft, axis=-1, workers=self.workers)
+
+        # (batch, mics, sources, blocks, bins)
+        spectra = signal_spectra[:, None] * rir_spectra[:, :, :, None]
+        images = fft.irfft(spectra, n_fft, axis=-1, workers=self.workers)
+
+        # Overlap-add, every block output spans num_chunks block lengths
+        num_chunks = -(-n_fft // block_size)
+        padded = self._buffer(
+            "padded", (batch, mics, sources, num_blocks, num_chunks * block_size)
+        )
+        padded[..., :n_fft] = images
+        padded[..., n_fft:] = 0
+        padded = padded.reshape(
+            batch, mics, sources, num_blocks, num_chunks, block_size
+        )
+
+        accumulator = self._buffer(
+            "accumulator",
+            (batch, mics, sources, num_blocks + num_chunks - 1, block_size),
+        )
+        accumulator[...] = 0
+        for chunk in range(num_chunks):
+            accumulator[..., chunk : chunk + num_blocks, :] += padded[..., chunk, :]
+        accumulator = accumulator.reshape(batch, mics, sources, -1)
+
+        if out is None:
+            out = np.empty((batch, mics, sources, out_length), dtype=self.dtype)
+        out[...] = accumulator[..., :out_length]
+        return out
+
+
+# One convolver per process, so buffers are reused across dialogues
+CONVOLVER = BatchConvolver()
+
+
+def stack_rirs(rirs, dtype=np.float32):
+    """
+    Stack nested room impulse responses rirs[mic][source] of different lengths
+    into a zero padded (mics, sources, samples) array
+    """
+    length = max(len(rir) for row in rirs for rir in row)
+    stacked = np.zeros((len(rirs), len(rirs[0]), length), dtype=dtype)
+    for m, row in enumerate(rirs):
+        for s, rir in enumerate(row):
+            stacked[m, s, : len(rir)] = rir
+    return stacked
@@ -0,0 +1,162 @@
+import random
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from libridialogue import settings
+from libridialogue.generate import (
+    load_utterances,
+    mix_libridialogue_clean,
+    sample_pairs,
+)
+from libridialogue.rir_bank import open_rir_bank
+from libridialogue.simulate_dialogue_reverb import (
+    compute_scene_rirs,
+    convolve_scene,
+    sample_scene,
+)
+from libridialogue.util.audio_io import read_audio, resample
+from libridialogue.util.seeding import derive_seed, seed_all
+
+
+class LRUCache:
+    """
+    Least recently used cache of a fixed number of entries
+    """
+
+    def __init__(self, size):
+        self.size = int(size)
+        self.entries = OrderedDict()
+
+    def get(self, key, load):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        value = load()
+        if self.size > 0:
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+
+class LibriDialogueDataset(IterableDataset):
+    """
+    Generates LibriDialogue pairs on the fly without writing them to disk.
+
+    Every item is a tuple (mixture_1, mixture_2, targets) of float32 tensors, the
+    reverb-dual signals at both microphones and the reverb-solo signals of both
+    speakers as (2, samples). The signals of a pair have the same length, pairs
+    differ in length.
+
+    Every pair is seeded by its index, the pairs of an epoch are split between the
+    DataLoader workers, so the items are deterministic and never repeated across
+    workers. Decoded utterances and room impulse responses are cached per worker.
+
+    Args:
+    - librispeech_path (str): Path to a LibriSpeech subset with a dataset.csv
+    - num_pairs (int): Number of pairs per epoch
+    - sample_rate (int): Sample rate of the outputs
+    - rir_bank_path (str): Sample scenes from this RIR bank, otherwise scenes are
+      simulated from a virtual bank of num_scenes seeded scenes
+    - num_scenes (int): Number of distinct simulated scenes
+    - utterance_cache_size (int): Number of decoded utterances cached per worker
+    - rir_cache_size (int): Number of scenes cached per worker
+    """
+
+    def __init__(
+        self,
+        librispeech_path,
+        num_pairs=settings.LIBRIDIALOGUE_SIZE,
+        sample_rate=16000,
+        rir_bank_path=settings.LIBRIDIALOGUE_RIR_BANK_PATH,
+        num_scenes=1000,
+        utterance_cache_size=512,
+        rir_cache_size=256,
+        random_seed=settings.RANDOM_SEED,
+    ):
+        super().__init__()
+        self.paths = load_utterances(librispeech_path)["audiopath"].to_numpy()
+        self.num_pairs = int(num_pairs)
+        self.sample_rate = int(sample_rate)
+        self.rir_bank_path = rir_bank_path
+        self.num_scenes = int(num_scenes)
+        self.random_seed = random_seed
+        self.epoch = 0
+        self.utterance_cache = LRUCache(utterance_cache_size)
+        self.rir_cache = LRUCache(rir_cache_size)
+        if rir_bank_path:
+            open_rir_bank(rir_bank_path).check_rate(self.sample_rate)
+
+    def set_epoch(self, epoch):
+        """
+        Draw different pairs for every epoch, call before iterating
+        """
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_pairs
+
+    def _load_utterance(self, path):
+        def load():
+            audio, rate = read_audio(path)
+            return resample(audio, rate, self.sample_rate)
+
+        return self.utterance_cache.get(path, load)
+
+    def _load_rirs(self):
+        if self.rir_bank_path:
+            rir_bank = open_rir_bank(self.rir_bank_path)
+            scene_index = random.randrange(len(rir_bank))
+            return self.rir_cache.get(
+                scene_index, lambda: rir_bank.get(scene_index, self.sample_rate)[1]
+            )
+
+        scene_index = random.randrange(self.num_scenes)
+
+        def simulate():
+            # A scene only depends on its index, not on the worker simulating it
+            state = random.getstate(), np.random.get_state()
+            seed_all(derive_seed(self.random_seed, "dataset-scene", scene_index))
+            rirs = compute_scene_rirs(sample_scene(), self.sample_rate)
+            random.setstate(state[0])
+            np.random.set_state(state[1])
+            return rirs
+
+        return self.rir_cache.get(scene_index, simulate)
+
+    def generate_pair(self, index, i, j):
+        seed_all(derive_seed(self.random_seed, "dataset", self.epoch, index))
+
+        audio_1 = self._load_utterance(self.paths[i])
+        audio_2 = self._load_utterance(self.paths[j])
+        mixes, _ = mix_libridialogue_clean(
+            audio_1, self.sample_rate, audio_2, self.sample_rate, [self.sample_rate]
+        )
+        clean_1, clean_2 = mixes[self.sample_rate]
+
+        single_1, single_2, dual_1, dual_2 = convolve_scene(
+            self._load_rirs(), clean_1, clean_2
+        )
+
+        mixture_1 = torch.from_numpy(dual_1.astype(np.float32) / 32768.0)
+        mixture_2 = torch.from_numpy(dual_2.astype(np.float32) / 32768.0)
+        targets = torch.from_numpy(
+            np.stack([single_1, single_2]).astype(np.float32) / 32768.0
+        )
+        return mixture_1, mixture_2, targets
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+
+        rng = random.Random(derive_seed(self.random_seed, "dataset", self.epoch))
+        pairs = sample_pairs(len(self.paths), self.num_pairs, rng)
+
+        # Every worker generates a disjoint, strided slice of the pairs
+        for index in range(worker_id, len(pairs), num_workers):
+            i, j = pairs[index]
+            yield self.generate_pair(index, i, j)
@@ -1,11 +1,30 @@
-import pandas as pd
-import itertools
+import numpy as np
 import random
+import math
 from libridialogue import settings
-from libridialogue.simulate_dialogue_reverb import simulate_libridialogue_reverb
+from libridialogue.simulate_dialogue_reverb import (
+    compute_scene_rirs,
+    convolve_scene,
+    resample_rirs,
+    sample_scene,
+)
+from libridialogue.rir_bank import open_rir_bank
+from libridialogue.librispeech.generate_csv import load_index
+from libridialogue.manifest import (
+    MANIFEST_FILE,
+    append_manifest,
+    manifest_file,
+    read_manifest,
+)
+from libridialogue.shards import ShardWriter
+from libridialogue.util.audio_io import encode_wav, read_audio, resample, write_wav
+from libridialogue.util.seeding import derive_seed, seed_all
 import os
+import glob
 from tqdm import tqdm
 from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 
 
 def build_libridialogue_clean(
@@ -61,64 +80,313 @@ def build_libridialogue_clean(
     audio_2_out.export(audio_out_2_path, format="wav")
 
 
+def build_libridialogue_clean_mixes(audio_in_1_path, audio_in_2_path, sample_rates):
+    """
+    Build the clean dialogue of two utterances for every sample rate in memory.
+    Each utterance is decoded once and resampled to all rates, the second speaker
+    starts at a sample exact offset.
+
+    Returns:
+    - dict: sample rate -> (audio_1_out, audio_2_out) as float32 arrays
+    - float: overlap of both utterances in seconds
+    """
+    # Load input audio files
+    audio_1_in, rate_1 = read_audio(audio_in_1_path)
+    audio_2_in, rate_2 = read_audio(audio_in_2_path)
+
+    return mix_libridialogue_clean(audio_1_in, rate_1, audio_2_in, rate_2, sample_rates)
+
+
+def mix_libridialogue_clean(audio_1_in, rate_1, audio_2_in, rate_2, sample_rates):
+    """
+    Build the clean dialogue of two decoded utterances for every sample rate,
+    see build_libridialogue_clean_mixes
+    """
+    # Get lengths in seconds
+    audio_1_in_length = len(audio_1_in) / rate_1
+    audio_2_in_length = len(audio_2_in) / rate_2
+
+    # Determine overlap, ensuring it's valid
+    min_overlap = float(settings.LIBRIDIALOGUE_MIN_OVERLAP)
+    max_overlap = min(
+        float(settings.LIBRIDIALOGUE_MAX_OVERLAP), audio_1_in_length, audio_2_in_length
+    )
+
+    if min_overlap > max_overlap:
+        # Adjust min_overlap if it's greater than max_overlap
+        min_overlap = max_overlap
+
+    # Calculate random overlap within the valid range
+    overlap = random.uniform(min_overlap, max_overlap)
+
+    mixes = {}
+    for sample_rate in sample_rates:
+        audio_1 = resample(audio_1_in, rate_1, sample_rate)
+        audio_2 = resample(audio_2_in, rate_2, sample_rate)
+
+        # Start of the second speaker in samples
+        position = max(0, round((audio_1_in_length - overlap) * sample_rate))
+        audio_out_length = max(len(audio_1), position + len(audio_2))
+
+        audio_1_out = np.zeros(audio_out_length, dtype=np.float32)
+        audio_2_out = np.zeros(audio_out_length, dtype=np.float32)
+        audio_1_out[: len(audio_1)] = audio_1
+        audio_2_out[position : position + len(audio_2)] = audio_2
+
+        mixes[sample_rate] = (audio_1_out, audio_2_out)
+
+    return mixes, overlap
+
+
+def unrank_pair(rank, population_size):
+    """
+    Map a rank in [0, n * (n - 1) / 2) to the pair (i, j) with i < j at that position
+    of itertools.combinations(range(n), 2)
+    """
+    n = population_size
+    i = n - 2 - (math.isqrt(4 * n * (n - 1) - 8 * rank - 7) - 1) // 2
+    j = rank - i * (2 * n - i - 1) // 2 + i + 1
+    return i, j
+
+
+def sample_pairs(population_size, size, rng=random):
+    """
+    Draw distinct unordered index pairs (i, j) with i < j in O(size) time and memory,
+    without materialising all combinations.
+    Draws the same ranks as random.sample(range(n * (n - 1) / 2), size) for large
+    populations, and a larger size always extends the pairs of a smaller one.
+    """
+    total = population_size * (population_size - 1) // 2
+    if not 0 <= size <= total:
+        raise ValueError(
+            f"Cannot sample {size} pairs from {population_size} utterances"
+        )
+
+    selected = set()
+    pairs = []
+    for _ in range(size):
+        rank = rng.randrange(total)
+        while rank in selected:
+            rank = rng.randrange(total)
+        selected.add(rank)
+        pairs.append(unrank_pair(rank, population_size))
+
+    return pairs
+
+
+def load_utterances(librispeech_path):
+    """
+    Load the LibriSpeech index as a table indexed by utterance id
+    """
+    df = load_index(librispeech_path)
+    return df.set_index("id", drop=False)
+
+
+def pair_seed(index, random_seed=settings.RANDOM_SEED):
+    """
+    Derive the seed of a single pair from the global random seed and the pair index,
+    so every pair can be generated independently of all other pairs.
+    """
+    return derive_seed(random_seed, index)
+
+
+def rate_label(rate):
+    """
+    Name of the directory of a sample rate, e.g. 8k for 8000
+    """
+    return f"{int(rate) // 1000}k"
+
+
+def generate_pair(
+    job,
+    libridialogue_path,
+    sample_rates=settings.LIBRIDIALOGUE_SAMPLE_RATES,
+    rir_bank_path=None,
+    output_format="wav",
+):
+    """
+    Generate all outputs of a single pair
+
+    Returns:
+    - dict: Manifest entry of the pair
+    - dict: Output name -> encoded wav for the tar output format, otherwise the
+      files are written directly and the dict is empty
+    """
+    index, id_1, id_2, audio_in_1, audio_in_2 = job
+
+    # Seed the random number generators per pair to be independent of the worker
+    seed = pair_seed(index)
+    seed_all(seed)
+
+    sample_rates = sorted(int(rate) for rate in sample_rates)
+    mixes, overlap = build_libridialogue_clean_mixes(
+        audio_in_1, audio_in_2, sample_rates
+    )
+
+    # One scene per pair at the highest rate, either sampled from the RIR bank
+    # or simulated, lower rates are derived by band-limited decimation
+    if rir_bank_path:
+        rir_bank = open_rir_bank(rir_bank_path)
+        scene_index = random.randrange(len(rir_bank))
+        scene, rirs = rir_bank.get(scene_index)
+        scene = dict(scene, rir_bank_index=scene_index)
+        scene_rate = rir_bank.fs
+    else:
+        scene = sample_scene()
+        scene_rate = sample_rates[-1]
+        rirs = compute_scene_rirs(scene, scene_rate)
+
+    outputs = []
+    files = {}
+    for rate, (audio_1, audio_2) in mixes.items():
+        single_1, single_2, dual_1, dual_2 = convolve_scene(
+            resample_rirs(rirs, scene_rate, rate), audio_1, audio_2
+        )
+
+        # Write every output file exactly once
+        for kind, signal_1, signal_2 in [
+            ("clean", audio_1, audio_2),
+            ("reverb-solo", single_1, single_2),
+            ("reverb-dual", dual_1, dual_2),
+        ]:
+            output_1 = f"{rate_label(rate)}/{kind}/{id_1}_{id_2}.wav"
+            output_2 = f"{rate_label(rate)}/{kind}/{id_2}_{id_1}.wav"
+            if output_format == "tar":
+                files[output_1] = encode_wav(signal_1, rate)
+                files[output_2] = encode_wav(signal_2, rate)
+            else:
+                write_wav(f"{libridialogue_path}/{output_1}", signal_1, rate)
+                write_wav(f"{libridialogue_path}/{output_2}", signal_2, rate)
+            outputs += [output_1, output_2]
+
+    entry = {
+        "index": index,
+        "seed": seed,
+        "id_1": str(id_1),
+        "id_2": str(id_2),
+        "overlap": overlap,
+        "scene": scene,
+        "outputs": outputs,
+    }
+    return entry, files
+
+
 def generate(
     librispeech_path=settings.LIBRISPEECH_PATH,
     libridialogue_path=settings.LIBRIDIALOGUE_PATH,
     libridialogue_size=settings.LIBRIDIALOGUE_SIZE,
+    num_workers=settings.LIBRIDIALOGUE_NUM_WORKERS,
+    rir_bank_path=settings.LIBRIDIALOGUE_RIR_BANK_PATH,
+    sample_rates=settings.LIBRIDIALOGUE_SAMPLE_RATES,
+    resume=settings.LIBRIDIALOGUE_RESUME,
+    output_format=settings.LIBRIDIALOGUE_OUTPUT_FORMAT,
+    shard_size=settings.LIBRIDIALOGUE_SHARD_SIZE,
+    shard=None,
 ):
+    """
+    Generate a LibriDialogue dataset, or with shard=(i, N) the disjoint slice of
+    every N-th pair starting at pair i. The shards of several nodes are combined
+    with manifest.merge_manifests into the dataset of a single run.
+    """
 
     random.seed(settings.RANDOM_SEED)
 
-    # check if the output directory exists
-    if os.path.exists(libridialogue_path):
+    manifest_path = os.path.join(libridialogue_path, manifest_file(shard))
+
+    # a misconfigured bank fails before the output directory is created
+    if rir_bank_path:
+        open_rir_bank(rir_bank_path).check_rate(max(int(r) for r in sample_rates))
+
+    # check if the output directory exists, shards of several nodes share it
+    if os.path.exists(libridialogue_path) and not resume and shard is None:
         print("Dataset already generated, skipping...")
         return
     else:
-        os.makedirs(libridialogue_path)
+        os.makedirs(libridialogue_path, exist_ok=True)
+
+    # pairs completed by a previous run
+    completed = read_manifest(os.path.join(libridialogue_path, MANIFEST_FILE))
+    completed.update(read_manifest(manifest_path))
 
     # read csv file
-    df = pd.read_csv(
-        librispeech_path + "/dataset.csv", sep=",", encoding="utf-8", header=0
+    utterances = load_utterances(librispeech_path)
+    ids = utterances["id"].to_numpy()
+
+    # a larger size extends the pairs of a smaller one, so resuming with a larger
+    # size only generates the new pairs
+    selected_pairs = sample_pairs(len(ids), int(libridialogue_size))
+
+    # build one job per missing pair, the pair index determines the seed of the pair
+    # i < j keeps the first utterance of a pair the one listed first in the csv
+    jobs = []
+    for index, (i, j) in enumerate(selected_pairs):
+        if shard is not None and index % shard[1] != shard[0]:
+            continue
+        id_1 = ids[i]
+        id_2 = ids[j]
+        if index in completed:
+            if (completed[index]["id_1"], completed[index]["id_2"]) != (id_1, id_2):
+                raise ValueError(
+                    f"Pair {index} in {manifest_path} does not match the current "
+                    "configuration, the dataset cannot be resumed"
+                )
+            continue
+        audio_in_1 = utterances.at[id_1, "audiopath"]
+        audio_in_2 = utterances.at[id_2, "audiopath"]
+        jobs.append((index, id_1, id_2, audio_in_1, audio_in_2))
+
+    if completed:
+        print(f"Resuming, {len(jobs)} pairs missing...")
+
+    # wav files cut off by a crash before their rename, shards of other nodes may
+    # be writing theirs, so a shard only removes the files of its own pairs
+    missing_pairs = {frozenset((str(id_1), str(id_2))) for _, id_1, id_2, _, _ in jobs}
+    for partial_file in glob.glob(
+        os.path.join(libridialogue_path, "*", "*", "*.wav.partial")
+    ):
+        name = os.path.basename(partial_file)[: -len(".wav.partial")]
+        if shard is None or frozenset(name.split("_")) in missing_pairs:
+            os.remove(partial_file)
+
+    generate_pair_partial = partial(
+        generate_pair,
+        libridialogue_path=libridialogue_path,
+        sample_rates=sample_rates,
+        rir_bank_path=rir_bank_path,
+        output_format=output_format,
     )
 
-    pairs = list(itertools.combinations(df["id"], 2))
-
-    selected_pairs = random.sample(pairs, int(libridialogue_size))
-
-    # iterate over all pairs
-    for pair in tqdm(selected_pairs):
-        subset = df.loc[df["id"].isin(pair)]
-        id_1 = subset.iloc[0]["id"]
-        id_2 = subset.iloc[1]["id"]
-        audio_in_1 = subset.iloc[0]["audiopath"]
-        audio_in_2 = subset.iloc[1]["audiopath"]
-        build_libridialogue_clean(
-            audio_in_1,
-            audio_in_2,
-            f"{libridialogue_path}/8k/clean/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/8k/clean/{id_2}_{id_1}.wav",
-            8000,
-        )
-        build_libridialogue_clean(
-            audio_in_1,
-            audio_in_2,
-            f"{libridialogue_path}/16k/clean/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/16k/clean/{id_2}_{id_1}.wav",
-            16000,
-        )
-        simulate_libridialogue_reverb(
-            f"{libridialogue_path}/8k/clean/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/8k/clean/{id_2}_{id_1}.wav",
-            f"{libridialogue_path}/8k/reverb-solo/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/8k/reverb-solo/{id_2}_{id_1}.wav",
-            f"{libridialogue_path}/8k/reverb-dual/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/8k/reverb-dual/{id_2}_{id_1}.wav",
-        )
-        simulate_libridialogue_reverb(
-            f"{libridialogue_path}/16k/clean/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/16k/clean/{id_2}_{id_1}.wav",
-            f"{libridialogue_path}/16k/reverb-solo/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/16k/reverb-solo/{id_2}_{id_1}.wav",
-            f"{libridialogue_path}/16k/reverb-dual/{id_1}_{id_2}.wav",
-            f"{libridialogue_path}/16k/reverb-dual/{id_2}_{id_1}.wav",
-        )
+    # pairs packed into tar shards are recorded once their shard is complete
+    writer = None
+    if output_format == "tar":
+        prefix = "shard" if shard is None else f"shard-{shard[0]}-of-{shard[1]}"
+        writer = ShardWriter(libridialogue_path, shard_size, prefix=prefix)
+
+    def record(result):
+        entry, files = result
+        if writer is None:
+            append_manifest(manifest_path, entry)
+        else:
+            for completed_entry in writer.add(entry, files):
+                append_manifest(manifest_path, completed_entry)
+
+    # iterate over all pairs, every completed pair is recorded immediately.
+    # Tar shards are filled in pair order, so their content does not depend on
+    # the scheduling of the workers
+    if int(num_workers) <= 1:
+        for job in tqdm(jobs):
+            record(generate_pair_partial(job))
+    elif writer is not None:
+        with ProcessPoolExecutor(max_workers=int(num_workers)) as executor:
+            results = executor.map(generate_pair_partial, jobs)
+            for result in tqdm(results, total=len(jobs)):
+                record(result)
+    else:
+        with ProcessPoolExecutor(max_workers=int(num_workers)) as executor:
+            futures = [executor.submit(generate_pair_partial, job) for job in jobs]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                record(future.result())
+
+    if writer is not None:
+        for completed_entry in writer.close():
+            append_manifest(manifest_path, completed_entry)
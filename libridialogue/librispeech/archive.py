@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import tarfile
+from functools import lru_cache
+
+# Separates the archive from the member in an audiopath, e.g.
+# datasets/LibriSpeech/test-clean.tar::LibriSpeech/test-clean/19/198/19-198-0000.flac
+ARCHIVE_SEPARATOR = "::"
+
+
+def archive_index_path(tar_path):
+    return tar_path + ".index.json"
+
+
+def index_archive(tar_path):
+    """
+    Record the data offset and size of every file in an uncompressed tar archive,
+    so members can be read with a single seek
+
+    Returns:
+    - dict: Member name -> (offset, size)
+    """
+    index_path = archive_index_path(tar_path)
+    if os.path.exists(index_path):
+        return load_archive_index(tar_path)
+
+    members = {}
+    with tarfile.open(tar_path, "r:") as tar:
+        for info in tar:
+            if info.isfile():
+                members[info.name] = (info.offset_data, info.size)
+
+    partial_path = index_path + ".partial"
+    with open(partial_path, "w") as f:
+        json.dump(members, f)
+    os.replace(partial_path, index_path)
+
+    return members
+
+
+@lru_cache(maxsize=None)
+def load_archive_index(tar_path):
+    with open(archive_index_path(tar_path)) as f:
+        return {name: tuple(value) for name, value in json.load(f).items()}
+
+
+def is_archive_path(path):
+    return ARCHIVE_SEPARATOR in str(path)
+
+
+def archive_path(tar_path, member_name):
+    return f"{tar_path}{ARCHIVE_SEPARATOR}{member_name}"
+
+
+def read_member(path):
+    """
+    Read a file by its path, which may refer to a file inside an archive
+    """
+    if not is_archive_path(path):
+        with open(path, "rb") as f:
+            return f.read()
+    tar_path, member_name = str(path).split(ARCHIVE_SEPARATOR, 1)
+    offset, size = load_archive_index(tar_path)[member_name]
+    with open(tar_path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def open_source(path):
+    """
+    The path itself for files on disk, an in-memory file object for files inside
+    an archive
+    """
+    if is_archive_path(path):
+        return io.BytesIO(read_member(path))
+    return path
@@ -1,8 +1,238 @@
+import gzip
+import hashlib
+import io
 import os
+import shutil
+import tarfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from libridialogue import settings
 
+# Base URL for LibriSpeech data
+BASE_URL = "http://www.openslr.org/resources/12/"
+
+
+class ResumableHTTPStream:
+    """
+    Read-only file object over an HTTP download, a dropped connection is resumed
+    with a Range request at the current position. All bytes read are hashed.
+    With a spool file the received bytes are appended to it, a restarted download
+    replays the spool file first and continues the download where it ends.
+    """
+
+    def __init__(self, url, spool_path=None, retries=5, timeout=60):
+        self.url = url
+        self.retries = retries
+        self.timeout = timeout
+        self.position = 0
+        self.length = None
+        self.md5 = hashlib.md5()
+        self.response = None
+        self.replay = None
+        self.spool = None
+        if spool_path is not None:
+            if os.path.exists(spool_path):
+                self.position = os.path.getsize(spool_path)
+                self.replay = open(spool_path, "rb")
+            self.spool = open(spool_path, "ab")
+
+    def _connect(self):
+        request = urllib.request.Request(self.url)
+        if self.position > 0:
+            request.add_header("Range", f"bytes={self.position}-")
+        try:
+            self.response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            # The spool file of an interrupted run holds the whole download
+            if error.code != 416 or self.position == 0:
+                raise
+            self.response = io.BytesIO()
+            self.length = self.position
+            return
+        if self.position > 0 and self.response.status != 206:
+            raise IOError(f"Server does not support resuming {self.url}")
+        content_length = self.response.headers.get("Content-Length")
+        if content_length is not None:
+            self.length = self.position + int(content_length)
+
+    def read(self, size=-1):
+        if self.replay is not None:
+            data = self.replay.read(size)
+            if data:
+                self.md5.update(data)
+                return data
+            self.replay.close()
+            self.replay = None
+
+        if self.response is None:
+            self._connect()
+        for attempt in range(self.retries + 1):
+            try:
+                data = self.response.read(size)
+                # A closed connection ends the response early without an error
+                if not data and self.length is not None and self.position < self.length:
+                    raise IOError("connection closed")
+                break
+            except (OSError, urllib.error.URLError) as error:
+                if attempt == self.retries:
+                    raise
+                print(f"Connection lost ({error}), resuming at {self.position}...")
+                self.response.close()
+                self._connect()
+        self.position += len(data)
+        self.md5.update(data)
+        if self.spool is not None:
+            self.spool.write(data)
+        return data
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+        if self.replay is not None:
+            self.replay.close()
+        if self.spool is not None:
+            self.spool.close()
+
+
+def fetch_checksums(base_url=BASE_URL):
+    """
+    Fetch the md5 checksums published next to the archives
+
+    Returns:
+    - dict: archive file name -> md5, empty if no checksums are available
+    """
+    try:
+        with urllib.request.urlopen(base_url + "md5sum.txt", timeout=60) as response:
+            lines = response.read().decode("utf-8").splitlines()
+    except (OSError, urllib.error.URLError) as error:
+        print(f"Warning: No checksums available at {base_url}md5sum.txt ({error})")
+        return {}
+
+    checksums = {}
+    for line in lines:
+        if line.strip():
+            md5, filename = line.split()
+            checksums[filename] = md5
+    return checksums
+
+
+def remove_partial(*paths):
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def download_package(package, directory, base_url=BASE_URL, checksum=None, spool=False):
+    """
+    Stream a LibriSpeech archive straight into the tar extractor, without storing
+    the archive. The package is extracted into a partial directory and moved into
+    place once the checksum is verified. Until then the extracted members are
+    listed in a progress file, so a restarted process skips them.
 
-def download(packages=None, directory=settings.LIBRISPEECH_PATH):
+    A dropped connection is resumed within the process. With spool, the received
+    bytes are also kept in a spool file, so a restarted process continues the
+    download where it stopped instead of at the start. The spool file grows to
+    the size of the compressed archive, on top of the extracted files.
+    """
+    tar_filename = f"{package}.tar.gz"
+    package_path = os.path.join(directory, package)
+    partial_path = os.path.join(directory, f".{package}.partial")
+    spool_path = os.path.join(directory, f".{tar_filename}.partial") if spool else None
+    progress_path = os.path.join(directory, f".{package}.progress")
+    prefix = f"LibriSpeech/{package}/"
+
+    extracted = set()
+    if os.path.exists(progress_path):
+        with open(progress_path, "r", encoding="utf-8") as f:
+            extracted = set(f.read().splitlines())
+
+    print(f"Downloading {package}...")
+    stream = ResumableHTTPStream(base_url + tar_filename, spool_path)
+    try:
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar, open(
+            progress_path, "a", encoding="utf-8"
+        ) as progress:
+            for member in tar:
+                # Only extract the package, not the readme files of the archive
+                if not member.name.startswith(prefix):
+                    continue
+                member.name = member.name[len(prefix) :]
+                if not member.name or (
+                    member.name in extracted
+                    and os.path.lexists(os.path.join(partial_path, member.name))
+                ):
+                    continue
+                tar.extract(member, partial_path, filter="data")
+                progress.write(member.name + "\n")
+                progress.flush()
+
+        # Hash the padding after the end of the tar archive as well
+        while stream.read(1 << 20):
+            pass
+    finally:
+        stream.close()
+
+    partial_files = [partial_path, progress_path] + ([spool_path] if spool else [])
+    if checksum is not None and stream.md5.hexdigest() != checksum:
+        remove_partial(*partial_files)
+        raise IOError(f"Checksum mismatch for {tar_filename}")
+
+    os.rename(partial_path, package_path)
+    remove_partial(*partial_files)
+    return package_path
+
+
+def download_archive(package, directory, base_url=BASE_URL, checksum=None):
+    """
+    Stream a LibriSpeech archive into an uncompressed tar file, which can be read
+    by offset without extracting it. The FLAC files are compressed already, so the
+    archive grows only slightly. The compressed bytes are not kept, a dropped
+    connection is resumed within the process.
+    """
+    tar_filename = f"{package}.tar.gz"
+    archive_path = os.path.join(directory, f"{package}.tar")
+    partial_path = archive_path + ".partial"
+
+    print(f"Downloading {package}...")
+    stream = ResumableHTTPStream(base_url + tar_filename)
+    try:
+        with gzip.GzipFile(fileobj=stream) as gz, open(partial_path, "wb") as f:
+            shutil.copyfileobj(gz, f, 1 << 20)
+
+        while stream.read(1 << 20):
+            pass
+    finally:
+        stream.close()
+
+    if checksum is not None and stream.md5.hexdigest() != checksum:
+        os.remove(partial_path)
+        raise IOError(f"Checksum mismatch for {tar_filename}")
+
+    os.replace(partial_path, archive_path)
+    return archive_path
+
+
+def download(
+    packages=None,
+    directory=settings.LIBRISPEECH_PATH,
+    base_url=BASE_URL,
+    num_workers=4,
+    extract=True,
+    verify=True,
+    spool=False,
+):
+    """
+    Download LibriSpeech packages that do not exist in directory yet. Every
+    archive is verified with the md5sum.txt published next to it, unless verify
+    is disabled. With spool, an extracted download interrupted by a restart
+    continues where it stopped, at the cost of keeping the compressed archive on
+    disk until it is complete, see download_package.
+    """
     # Set default packages if none are provided
     if packages is None:
         packages = ["dev-clean"]
@@ -11,25 +241,46 @@ def download(packages=None, directory=settings.LIBRISPEECH_PATH):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    # Base URL for LibriSpeech data
-    base_url = "http://www.openslr.org/resources/12/"
+    # Packages are either extracted or kept as uncompressed archive
+    suffix = "" if extract else ".tar"
+    download_fn = (
+        partial(download_package, spool=spool) if extract else download_archive
+    )
 
-    # Download and extract the selected packages
+    missing = []
     for package in packages:
-        tar_filename = f"{package}.tar.gz"
-        download_url = os.path.join(base_url, tar_filename)
-        package_path = os.path.join(directory, package)
-
-        if os.path.exists(package_path):
+        if os.path.exists(os.path.join(directory, package + suffix)):
             print(f"Package {package} already exists, skipping...")
         else:
-            os.system(f"wget {download_url}")
-            os.system(f"tar -xzf {tar_filename}")
-            os.system(f"mv LibriSpeech/{package} {directory}")
-            os.system(f"rm {tar_filename}")
-            os.system("rm -rf LibriSpeech")
+            missing.append(package)
+
+    # Download and extract the selected packages concurrently
+    if missing:
+        checksums = fetch_checksums(base_url)
+        for package in missing:
+            if f"{package}.tar.gz" in checksums:
+                continue
+            if verify:
+                raise IOError(
+                    f"No checksum for {package}.tar.gz, download it with "
+                    "verify=False to skip the verification"
+                )
+            print(f"Warning: {package}.tar.gz is not verified")
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    download_fn,
+                    package,
+                    directory,
+                    base_url,
+                    checksums.get(f"{package}.tar.gz"),
+                )
+                for package in missing
+            ]
+            for future in futures:
+                future.result()
 
-    return [os.path.join(directory, package) for package in packages]
+    return [os.path.join(directory, package + suffix) for package in packages]
 
 
 # Example usage:
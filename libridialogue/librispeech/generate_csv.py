@@ -1,61 +1,161 @@
 import os
-import csv
-import random
+import hashlib
 import string
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import soundfile as sf
+from tqdm import tqdm
 
 from libridialogue import settings
+from libridialogue.librispeech.archive import (
+    archive_path,
+    index_archive,
+    open_source,
+    read_member,
+)
+
+ID_ALPHABET = string.ascii_letters + string.digits
+INDEX_COLUMNS = [
+    "id",
+    "audiopath",
+    "text",
+    "speaker",
+    "chapter",
+    "utterance",
+    "duration",
+    "sample_rate",
+    "frames",
+]
+
+
+def utterance_id(name, attempt=0):
+    """
+    Deterministic 6 character id of an utterance, e.g. 1089-134686-0000
+    """
+    key = name if attempt == 0 else f"{name}:{attempt}"
+    value = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+    id = ""
+    for _ in range(6):
+        value, digit = divmod(value, len(ID_ALPHABET))
+        id += ID_ALPHABET[digit]
+    return id
 
 
-def generate_csv(dir_path) -> None:
+def index_chapter(transcript_path):
     """
-    Loader function for librispeech dataset
-    Stores list of all files in a .csv file
-    Assigns UUID4 to every file
+    Index the utterances of a single transcript file, reading only the audio headers.
+    The transcript can be a file on disk or inside an archive.
+    """
+    dirpath = os.path.dirname(transcript_path)
+    rows = []
+    content = read_member(transcript_path).decode("utf-8").splitlines(keepends=True)
+    for line in content:
+        name, text = line.split(" ", 1)
+        speaker, chapter, utterance = name.split("-")
+        audiopath = os.path.join(dirpath, f"{name}.flac")
+        info = sf.info(open_source(audiopath))
+        rows.append(
+            {
+                "name": name,
+                "audiopath": audiopath,
+                "text": text.rstrip("\n"),  # exclude '\n'
+                "speaker": int(speaker),
+                "chapter": int(chapter),
+                "utterance": int(utterance),
+                "duration": info.frames / info.samplerate,
+                "sample_rate": info.samplerate,
+                "frames": info.frames,
+            }
+        )
+    return rows
+
+
+def generate_csv(
+    dir_path, num_workers=settings.LIBRIDIALOGUE_NUM_WORKERS, tar_path=None
+) -> None:
+    """
+    Indexer for a LibriSpeech subset
+    Stores all utterances with their audio metadata in a parquet file and a .csv file
+    Assigns a deterministic id to every utterance
     Expects a .txt file containing file id and transcript in the folder containing audio files
 
     Args:
-    - dir_path (str): Path to root folder of dataset
-    - csv_path (str): Path to the .csv file
+    - dir_path (str): Path to root folder of dataset, the index is stored here
+    - num_workers (int): Number of processes reading transcripts and audio headers
+    - tar_path (str): Index the files inside this uncompressed tar archive instead
+      of dir_path, the audiopaths then refer to the archive members
     """
 
     print(f"Generating CSV for {dir_path}...")
 
     csv_path = dir_path + "/dataset.csv"
+    parquet_path = dir_path + "/dataset.parquet"
 
-    if os.path.exists(csv_path):
-        print("CSV file already exists, skipping...")
+    if os.path.exists(parquet_path):
+        print("Index already exists, skipping...")
         return
 
-    set = []
-
-    for dirpath, dirnames, filenames in os.walk(dir_path):
-        if filenames and not filenames == [".DS_Store"]:
-
-            txt_files = [file for file in filenames if file.endswith(".txt")]
-            for file in txt_files:
-                with open(os.path.join(dirpath, file), "r") as f:
-                    content = f.readlines()
-                for line in content:
-                    id, text = line.split(" ", 1)
-                    set.append(
-                        {
-                            "id": "".join(
-                                random.choices(
-                                    string.ascii_letters + string.digits, k=6
-                                )
-                            ),
-                            "audiopath": os.path.join(dirpath, f"{id}.flac"),
-                            "text": text[:-1],  # exclude '\n'
-                        }
-                    )
-
-    with open(csv_path, "w", newline="") as csvfile:
-        fieldnames = ["id", "audiopath", "text"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        writer.writeheader()
-        writer.writerows(set)
-    # return set
+    transcript_paths = []
+    if tar_path is not None:
+        os.makedirs(dir_path, exist_ok=True)
+        for member_name in index_archive(tar_path):
+            if member_name.endswith(".trans.txt"):
+                transcript_paths.append(archive_path(tar_path, member_name))
+    else:
+        for dirpath, dirnames, filenames in os.walk(dir_path):
+            for file in filenames:
+                if file.endswith(".txt"):
+                    transcript_paths.append(os.path.join(dirpath, file))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, int(num_workers))) as executor:
+        for chapter_rows in tqdm(
+            executor.map(index_chapter, sorted(transcript_paths), chunksize=16),
+            total=len(transcript_paths),
+            desc="Indexing",
+        ):
+            rows += chapter_rows
+
+    df = pd.DataFrame(rows).sort_values("name", ignore_index=True)
+
+    if os.path.exists(csv_path):
+        # Keep the ids and order of an existing index, datasets generated from it
+        # refer to these ids
+        existing = pd.read_csv(csv_path, sep=",", encoding="utf-8", header=0)
+        order = {path: i for i, path in enumerate(existing["audiopath"])}
+        ids = dict(zip(existing["audiopath"], existing["id"]))
+        df["id"] = df["audiopath"].map(ids)
+        df["order"] = df["audiopath"].map(order)
+        df = df.sort_values("order", ignore_index=True, na_position="last")
+        df = df.drop(columns="order")
+    else:
+        df["id"] = None
+
+    # Assign deterministic ids to new utterances, resolving collisions
+    used = set(df["id"].dropna())
+    for i in df.index[df["id"].isna()]:
+        attempt = 0
+        id = utterance_id(df.at[i, "name"])
+        while id in used:
+            attempt += 1
+            id = utterance_id(df.at[i, "name"], attempt)
+        used.add(id)
+        df.at[i, "id"] = id
+
+    df = df[INDEX_COLUMNS]
+    df.to_parquet(parquet_path, index=False)
+    df.to_csv(csv_path, index=False)
+
+
+def load_index(dir_path):
+    """
+    Load the index of a LibriSpeech subset, from the parquet file if available
+    """
+    parquet_path = dir_path + "/dataset.parquet"
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+    return pd.read_csv(dir_path + "/dataset.csv", sep=",", encoding="utf-8", header=0)
 
 
 def generate_librispeech_csvs(librispeech_path=settings.LIBRISPEECH_PATH):
@@ -71,5 +171,11 @@ def generate_librispeech_csvs(librispeech_path=settings.LIBRISPEECH_PATH):
         "train-clean-360",
         "train-other-500",
     ]:
-        if os.path.exists(f"{librispeech_path}/{dataset}"):
+        # Subsets kept as archive are read without extraction
+        if os.path.exists(f"{librispeech_path}/{dataset}.tar"):
+            generate_csv(
+                f"{librispeech_path}/{dataset}",
+                tar_path=f"{librispeech_path}/{dataset}.tar",
+            )
+        elif os.path.exists(f"{librispeech_path}/{dataset}"):
             generate_csv(f"{librispeech_path}/{dataset}")
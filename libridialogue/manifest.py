@@ -0,0 +1,125 @@
+import glob
+import json
+import os
+
+from libridialogue import settings
+from libridialogue.shards import repack_shards
+
+MANIFEST_FILE = "manifest.jsonl"
+
+
+def parse_shard(shard):
+    """
+    Parse a shard specification i/N into (i, N)
+    """
+    try:
+        shard_index, shard_count = (int(value) for value in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {shard}, expected i/N")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard}, i must be in [0, N)")
+    return shard_index, shard_count
+
+
+def manifest_file(shard=None):
+    """
+    Name of the manifest of a whole dataset or of a shard (i, N) of it
+    """
+    if shard is None:
+        return MANIFEST_FILE
+    shard_index, shard_count = shard
+    return f"manifest-{shard_index}-of-{shard_count}.jsonl"
+
+
+def read_manifest(manifest_path):
+    """
+    Read the completed pairs of a manifest
+
+    Returns:
+    - dict: pair index -> manifest entry
+    """
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by a crash, the pair is generated again
+                continue
+            entries[entry["index"]] = entry
+
+    return entries
+
+
+def append_manifest(manifest_path, entry):
+    """
+    Record a completed pair, the entry is on disk when this function returns
+    """
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def merge_manifests(
+    libridialogue_path,
+    shard_count,
+    size,
+    shard_size=settings.LIBRIDIALOGUE_SHARD_SIZE,
+):
+    """
+    Combine the manifests of all shards of a dataset into its manifest.
+    The outputs of all shards are expected below libridialogue_path, e.g. on
+    shared storage or copied there from the nodes. Tar shards written by the
+    nodes are repacked in pair order, as a single run would have written them.
+
+    Args:
+    - libridialogue_path (str): Root of the dataset
+    - shard_count (int): Number of shards N
+    - size (int): Number of pairs of the dataset
+    - shard_size (int): Number of pairs per tar shard
+    """
+    manifest_path = os.path.join(libridialogue_path, MANIFEST_FILE)
+    entries = read_manifest(manifest_path)
+
+    shard_files = sorted(
+        glob.glob(
+            os.path.join(libridialogue_path, f"manifest-*-of-{int(shard_count)}.jsonl")
+        )
+    )
+    for shard_file in shard_files:
+        for index, entry in read_manifest(shard_file).items():
+            if index in entries and (
+                entries[index]["id_1"],
+                entries[index]["id_2"],
+            ) != (entry["id_1"], entry["id_2"]):
+                raise ValueError(
+                    f"Conflicting entries for pair {index} in {shard_file}"
+                )
+            entries[index] = entry
+
+    missing = [index for index in range(int(size)) if index not in entries]
+    if missing:
+        raise ValueError(
+            f"{len(missing)} of {size} pairs are missing, e.g. pair {missing[0]}, "
+            "generate the missing shards with resume enabled before merging"
+        )
+
+    entries, node_files = repack_shards(
+        libridialogue_path, entries, shard_count, shard_size
+    )
+
+    # Write the merged manifest sorted by pair index and replace the old one
+    partial_path = manifest_path + ".partial"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        for index in sorted(entries):
+            f.write(json.dumps(entries[index]) + "\n")
+    os.replace(partial_path, manifest_path)
+
+    for shard_file in shard_files + node_files:
+        os.remove(shard_file)
+
+    return len(entries)
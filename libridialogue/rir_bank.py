@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import numpy as np
+from tqdm import tqdm
+
+from libridialogue import settings
+from libridialogue.simulate_dialogue_reverb import (
+    compute_scene_rirs,
+    resample_rirs,
+    sample_scene,
+)
+from libridialogue.util.seeding import derive_seed, seed_all
+
+BANK_METADATA_FILE = "bank.json"
+BANK_RIRS_FILE = "rirs.npy"
+BANK_LENGTHS_FILE = "lengths.npy"
+
+
+def simulate_bank_scene(index, fs, fidelity, random_seed):
+    # Every scene of the bank has its own seed, independent of the worker
+    seed_all(derive_seed(random_seed, "rir-bank", index))
+    scene = sample_scene()
+    rirs = compute_scene_rirs(scene, fs, fidelity)
+    return index, scene, rirs
+
+
+def build_rir_bank(
+    bank_path=settings.LIBRIDIALOGUE_RIR_BANK_PATH,
+    size=settings.LIBRIDIALOGUE_RIR_BANK_SIZE,
+    fs=settings.LIBRIDIALOGUE_RIR_BANK_SAMPLE_RATE,
+    max_rir_length=settings.LIBRIDIALOGUE_RIR_BANK_MAX_RIR_LENGTH,
+    fidelity=settings.LIBRIDIALOGUE_ROOM_FIDELITY,
+    num_workers=settings.LIBRIDIALOGUE_NUM_WORKERS,
+    random_seed=settings.RANDOM_SEED,
+):
+    """
+    Precompute the 2x2 room impulse responses of random scenes and store them in a
+    memory-mappable bank together with the scene parameters
+
+    Args:
+    - bank_path (str): Output directory of the bank
+    - size (int): Number of scenes
+    - fs (int): Sample rate of the room impulse responses
+    - max_rir_length (float): Room impulse responses are truncated to this length
+      in seconds
+    - fidelity (str): Simulation fidelity tier
+    """
+    if os.path.exists(bank_path):
+        print("RIR bank already exists, skipping...")
+        return
+
+    # Build into a partial directory, so an interrupted build is never used
+    partial_path = bank_path + ".partial"
+    if os.path.exists(partial_path):
+        shutil.rmtree(partial_path)
+    os.makedirs(partial_path)
+
+    size = int(size)
+    fs = int(fs)
+    max_length = int(float(max_rir_length) * fs)
+
+    rirs = np.lib.format.open_memmap(
+        os.path.join(partial_path, BANK_RIRS_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(size, 2, 2, max_length),
+    )
+    lengths = np.zeros((size, 2, 2), dtype=np.int64)
+    scenes = [None] * size
+
+    simulate_partial = partial(
+        simulate_bank_scene, fs=fs, fidelity=fidelity, random_seed=random_seed
+    )
+
+    def store(result):
+        index, scene, scene_rirs = result
+        scenes[index] = scene
+        for m in range(2):
+            for s in range(2):
+                rir = scene_rirs[m][s][:max_length]
+                rirs[index, m, s, : len(rir)] = rir
+                lengths[index, m, s] = len(rir)
+
+    if int(num_workers) <= 1:
+        for index in tqdm(range(size), desc="Building RIR bank"):
+            store(simulate_partial(index))
+    else:
+        with ProcessPoolExecutor(max_workers=int(num_workers)) as executor:
+            for result in tqdm(
+                executor.map(simulate_partial, range(size)),
+                total=size,
+                desc="Building RIR bank",
+            ):
+                store(result)
+
+    rirs.flush()
+    del rirs
+    np.save(os.path.join(partial_path, BANK_LENGTHS_FILE), lengths)
+    with open(os.path.join(partial_path, BANK_METADATA_FILE), "w") as f:
+        json.dump(
+            {
+                "fs": fs,
+                "size": size,
+                "max_length": max_length,
+                "fidelity": fidelity,
+                "random_seed": str(random_seed),
+                "scenes": scenes,
+            },
+            f,
+        )
+
+    os.rename(partial_path, bank_path)
+
+
+class RirBank:
+    """
+    Read access to a bank built by build_rir_bank, the room impulse responses are
+    memory-mapped and only read when used
+    """
+
+    def __init__(self, bank_path):
+        with open(os.path.join(bank_path, BANK_METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.fs = metadata["fs"]
+        self.scenes = metadata["scenes"]
+        self.rirs = np.load(os.path.join(bank_path, BANK_RIRS_FILE), mmap_mode="r")
+        self.lengths = np.load(os.path.join(bank_path, BANK_LENGTHS_FILE))
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def check_rate(self, fs):
+        """
+        Raise a ValueError if outputs at fs would need upsampled room impulse
+        responses, which lack the band above the Nyquist frequency of the bank
+        """
+        if int(fs) > self.fs:
+            raise ValueError(
+                f"The RIR bank is sampled at {self.fs} Hz, it cannot be used for "
+                f"a sample rate of {fs} Hz"
+            )
+
+    def get(self, index, fs=None):
+        """
+        Get the scene parameters and the room impulse responses rirs[mic][source]
+        of a scene, resampled to fs if it differs from the rate of the bank
+        """
+        if fs is None:
+            fs = self.fs
+        rirs = [
+            [
+                np.array(self.rirs[index, m, s, : self.lengths[index, m, s]])
+                for s in range(2)
+            ]
+            for m in range(2)
+        ]
+        return self.scenes[index], resample_rirs(rirs, self.fs, fs)
+
+
+@lru_cache(maxsize=None)
+def open_rir_bank(bank_path):
+    """
+    Open a bank once per process
+    """
+    return RirBank(bank_path)
+
+
+if __name__ == "__main__":
+    build_rir_bank()
@@ -20,6 +20,7 @@ with open(CONFIG_PATH, "r", encoding="utf-8") as file:
 # LIBRISPEECH settings
 LIBRISPEECH_PATH = config["librispeech"]["path"]
 LIBRISPEECH_CSV = config["librispeech"]["csv"]
+LIBRISPEECH_ARCHIVE = config["librispeech"]["archive"]
 
 # Random seed
 RANDOM_SEED = config["random_seed"]
@@ -38,6 +39,13 @@ ANALYZE_REVERB_DUAL = config["analyze"]["reverb_dual"]
 ANALYZE_COSY = config["analyze"]["cosy"]
 ANALYZE_MOSSFORMER2 = config["analyze"]["mossformer2"]
 ANALYZE_CONVTASNET = config["analyze"]["convtasnet"]
+ANALYZE_NUM_WORKERS = int(config["analyze"]["num_workers"])
+ANALYZE_METRIC_CHUNK_SIZE = int(config["analyze"]["metric_chunk_size"])
+ANALYZE_BSS_BATCH_SIZE = int(config["analyze"]["bss_batch_size"])
+ANALYZE_ASR_MODEL = config["analyze"]["asr"]["model"]
+ANALYZE_ASR_DEVICE = config["analyze"]["asr"]["device"]
+ANALYZE_ASR_BATCH_SIZE = int(config["analyze"]["asr"]["batch_size"])
+ANALYZE_ASR_CACHE = config["analyze"]["asr"]["cache"]
 
 # LIBRIDIALOGUE settings
 LIBRIDIALOGUE_SIZE = config["libridialogue"]["size"]
@@ -45,6 +53,19 @@ LIBRIDIALOGUE_PATH = config["libridialogue"]["path"]
 LIBRIDIALOGUE_SEPARATED_PATH = config["libridialogue"]["separated_path"]
 LIBRIDIALOGUE_MIN_OVERLAP = config["libridialogue"]["min_overlap"]
 LIBRIDIALOGUE_MAX_OVERLAP = config["libridialogue"]["max_overlap"]
+LIBRIDIALOGUE_NUM_WORKERS = config["libridialogue"]["num_workers"]
+LIBRIDIALOGUE_SAMPLE_RATES = config["libridialogue"]["sample_rates"]
+LIBRIDIALOGUE_RESUME = config["libridialogue"]["resume"]
+LIBRIDIALOGUE_OUTPUT_FORMAT = config["libridialogue"]["output_format"]
+LIBRIDIALOGUE_SHARD_SIZE = config["libridialogue"]["shard_size"]
+
+# LIBRIDIALOGUE RIR bank settings
+LIBRIDIALOGUE_RIR_BANK_PATH = config["libridialogue"]["rir_bank"]["path"]
+LIBRIDIALOGUE_RIR_BANK_SIZE = config["libridialogue"]["rir_bank"]["size"]
+LIBRIDIALOGUE_RIR_BANK_SAMPLE_RATE = config["libridialogue"]["rir_bank"]["sample_rate"]
+LIBRIDIALOGUE_RIR_BANK_MAX_RIR_LENGTH = config["libridialogue"]["rir_bank"][
+    "max_rir_length"
+]
 
 # LIBRIDIALOGUE room settings
 LIBRIDIALOGUE_ROOM_MIN_TEMPERATURE = config["libridialogue"]["room"]["min_temperature"]
@@ -61,11 +82,15 @@ LIBRIDIALOGUE_ROOM_STEP_SIZE_SOURCE = config["libridialogue"]["room"][
 ]
 LIBRIDIALOGUE_ROOM_RT60_TGT = config["libridialogue"]["room"]["rt60_tgt"]
 LIBRIDIALOGUE_ROOM_SOURCE_Z = config["libridialogue"]["room"]["source_z"]
+LIBRIDIALOGUE_ROOM_FIDELITY = config["libridialogue"]["room"]["fidelity"]
+LIBRIDIALOGUE_ROOM_FIDELITY_TIERS = config["libridialogue"]["room"]["fidelity_tiers"]
 
 # COSY settings
 COSY_COMPRESSOR_PLUGIN_FILE = config["cosy"]["compressor_plugin_file"]
 COSY_GATE_PLUGIN_FILE = config["cosy"]["gate_plugin_file"]
 COSY_CONFIG_FILE = config["cosy"]["config_file"]
+COSY_NUM_WORKERS = config["cosy"]["num_workers"]
+COSY_TIMEOUT = float(config["cosy"]["timeout"])
 COSY_OPTIMIZATION_TRIALS = config["cosy"]["optimization_trials"]
 COSY_OPTIMIZATION_INITIAL_CONFIG_FILE = config["cosy"][
     "optimization_initial_config_file"
@@ -73,7 +98,18 @@ COSY_OPTIMIZATION_INITIAL_CONFIG_FILE = config["cosy"][
 COSY_OPTIMIZATION_PARAMETER_STEP_SIZE = config["cosy"][
     "optimization_parameter_step_size"
 ]
+COSY_OPTIMIZATION_N_JOBS = int(config["cosy"]["optimization_n_jobs"])
+COSY_OPTIMIZATION_PAIRS = int(config["cosy"]["optimization_pairs"])
+COSY_OPTIMIZATION_STEPS = int(config["cosy"]["optimization_steps"])
+COSY_OPTIMIZATION_METRIC = config["cosy"]["optimization_metric"]
+COSY_OPTIMIZATION_PATH = config["cosy"]["optimization_path"]
+
+# CONVTASNET settings
+CONVTASNET_BATCH_SIZE = int(config["convtasnet"]["batch_size"])
+CONVTASNET_MAX_PADDING = float(config["convtasnet"]["max_padding"])
+CONVTASNET_NUM_THREADS = config["convtasnet"]["num_threads"]
 
 # Output files
 ANALYSIS_CSV = config["analysis_csv"]
+ANALYSIS_FILES = config["analysis_files"]
 COMPUTATION_TIMES_CSV = config["computation_times_csv"]
@@ -0,0 +1,314 @@
+import glob
+import io
+import json
+import os
+import tarfile
+from functools import lru_cache
+
+SHARD_DIR = "shards"
+
+
+def shard_name(prefix, number):
+    return f"{prefix}-{number:06d}"
+
+
+class ShardWriter:
+    """
+    Pack the files of many dialogues into sequential tar shards of a fixed number
+    of pairs. Every shard is written to a temporary name and renamed when it is
+    complete, together with an index of the member offsets for random access.
+    """
+
+    def __init__(self, root, shard_size, prefix="shard"):
+        self.shard_path = os.path.join(root, SHARD_DIR)
+        self.shard_size = int(shard_size)
+        self.prefix = prefix
+        os.makedirs(self.shard_path, exist_ok=True)
+
+        # Remove shards of an interrupted run, their pairs are not in the manifest
+        pattern = os.path.join(self.shard_path, f"{prefix}-" + "[0-9]" * 6)
+        for partial_file in glob.glob(pattern + ".tar.partial"):
+            os.remove(partial_file)
+
+        existing = glob.glob(pattern + ".tar")
+        self.number = len(existing)
+        self.tar = None
+        self.entries = []
+        self.pairs = {}
+
+    def _open(self):
+        name = shard_name(self.prefix, self.number)
+        self.tar = tarfile.open(
+            os.path.join(self.shard_path, f"{name}.tar.partial"), "w"
+        )
+        self.entries = []
+        self.pairs = {}
+
+    def add(self, entry, files):
+        """
+        Add the files of a pair to the current shard
+
+        Args:
+        - entry (dict): Manifest entry of the pair
+        - files (dict): Member name -> file content as bytes
+
+        Returns:
+        - list: Manifest entries of the pairs whose shard was completed
+        """
+        if self.tar is None:
+            self._open()
+
+        name = shard_name(self.prefix, self.number)
+        entry = dict(entry, shard=f"{name}.tar")
+        pair_key = f"{entry['id_1']}_{entry['id_2']}"
+        files = dict(files)
+        files[f"meta/{pair_key}.json"] = json.dumps(entry).encode("utf-8")
+
+        for member_name, data in files.items():
+            info = tarfile.TarInfo(member_name)
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+        self.pairs[pair_key] = list(files)
+        self.entries.append(entry)
+
+        if len(self.entries) >= self.shard_size:
+            return self._close_shard()
+        return []
+
+    def _close_shard(self):
+        name = shard_name(self.prefix, self.number)
+        self.tar.close()
+        partial_file = os.path.join(self.shard_path, f"{name}.tar.partial")
+
+        # Index the member offsets for random access
+        members = {}
+        with tarfile.open(partial_file, "r") as tar:
+            for info in tar:
+                members[info.name] = [info.offset_data, info.size]
+        with open(os.path.join(self.shard_path, f"{name}.json"), "w") as f:
+            json.dump({"pairs": self.pairs, "members": members}, f)
+
+        os.replace(partial_file, os.path.join(self.shard_path, f"{name}.tar"))
+
+        entries = self.entries
+        self.tar = None
+        self.entries = []
+        self.number += 1
+        return entries
+
+    def close(self):
+        """
+        Complete the last shard
+
+        Returns:
+        - list: Manifest entries of the pairs in the last shard
+        """
+        if self.tar is None:
+            return []
+        return self._close_shard()
+
+
+class ShardReader:
+    """
+    Random access to the members of all shards of a dataset, and sequential
+    streaming of the pairs shard by shard
+    """
+
+    def __init__(self, root):
+        self.shard_path = os.path.join(root, SHARD_DIR)
+        self.members = {}
+        self.pairs = {}
+        for index_file in sorted(glob.glob(os.path.join(self.shard_path, "*.json"))):
+            shard_file = index_file[: -len(".json")] + ".tar"
+            if not os.path.exists(shard_file):
+                continue
+            with open(index_file) as f:
+                index = json.load(f)
+            for member_name, (offset, size) in index["members"].items():
+                self.members[member_name] = (shard_file, offset, size)
+            for pair_key, member_names in index["pairs"].items():
+                self.pairs[pair_key] = member_names
+
+    def listdir(self, directory):
+        """
+        Names of the files directly in a directory of the dataset, e.g. 8k/clean
+        """
+        prefix = directory.strip("/") + "/"
+        return sorted(
+            name[len(prefix) :]
+            for name in self.members
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]
+        )
+
+    def exists(self, member_name):
+        return member_name in self.members
+
+    def read(self, member_name):
+        shard_file, offset, size = self.members[member_name]
+        with open(shard_file, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def read_pair(self, pair_key):
+        """
+        All files of a pair by its key id_1_id_2
+
+        Returns:
+        - dict: Member name -> bytes
+        """
+        return {name: self.read(name) for name in self.pairs[pair_key]}
+
+    def iter_pairs(self):
+        """
+        Stream all pairs shard by shard with sequential reads
+
+        Yields:
+        - tuple: (pair key, dict of member name -> bytes)
+        """
+        for shard_file in sorted(glob.glob(os.path.join(self.shard_path, "*.tar"))):
+            pair_key = None
+            files = {}
+            with tarfile.open(shard_file, "r|") as tar:
+                for info in tar:
+                    data = tar.extractfile(info).read()
+                    files[info.name] = data
+                    # The metadata is the last member of a pair
+                    if info.name.startswith("meta/"):
+                        pair_key = os.path.basename(info.name)[: -len(".json")]
+                        yield pair_key, files
+                        files = {}
+
+
+@lru_cache(maxsize=None)
+def open_shards(root):
+    return ShardReader(root)
+
+
+def find_shard_root(dataset_path):
+    """
+    Split a dataset path like <root>/8k/reverb-dual into the root of a sharded
+    dataset and the directory inside the shards
+
+    Returns:
+    - tuple: (root, directory) or None if the path is not inside a sharded dataset
+    """
+    path = os.path.normpath(dataset_path)
+    directory = []
+    while path and path != os.path.dirname(path):
+        if os.path.isdir(os.path.join(path, SHARD_DIR)):
+            return path, "/".join(reversed(directory))
+        directory.append(os.path.basename(path))
+        path = os.path.dirname(path)
+    return None
+
+
+def list_files(dataset_path):
+    """
+    List the files of a dataset directory, either on disk or inside shards
+    """
+    if os.path.isdir(dataset_path):
+        return sorted(os.listdir(dataset_path))
+    shard_root = find_shard_root(dataset_path)
+    if shard_root is None:
+        raise FileNotFoundError(f"Dataset {dataset_path} does not exist")
+    root, directory = shard_root
+    return open_shards(root).listdir(directory)
+
+
+def file_exists(dataset_path, file_name):
+    if os.path.isdir(dataset_path):
+        return os.path.exists(os.path.join(dataset_path, file_name))
+    shard_root = find_shard_root(dataset_path)
+    if shard_root is None:
+        return False
+    root, directory = shard_root
+    return open_shards(root).exists(f"{directory}/{file_name}")
+
+
+def open_file(dataset_path, file_name):
+    """
+    Path of a file on disk, or an in-memory file object for a file inside shards.
+    Both can be passed to soundfile, librosa and torchaudio.
+    """
+    if os.path.isdir(dataset_path):
+        return os.path.join(dataset_path, file_name)
+    shard_root = find_shard_root(dataset_path)
+    if shard_root is None:
+        raise FileNotFoundError(f"Dataset {dataset_path} does not exist")
+    root, directory = shard_root
+    return io.BytesIO(open_shards(root).read(f"{directory}/{file_name}"))
+
+
+def local_path(dataset_path, file_name, tmp_dir):
+    """
+    Path of a file on disk, files inside shards are written to tmp_dir first.
+    For tools that can only read from paths.
+    """
+    if os.path.isdir(dataset_path):
+        return os.path.join(dataset_path, file_name)
+    path = os.path.join(tmp_dir, file_name)
+    with open(path, "wb") as f:
+        f.write(open_file(dataset_path, file_name).read())
+    return path
+
+
+def repack_shards(root, entries, shard_count, shard_size):
+    """
+    Repack the pairs of the node shards shard-i-of-N-* in pair order into the
+    shards of a single run. Pairs already in shards of a single run keep them.
+
+    Args:
+    - root (str): Root of the dataset
+    - entries (dict): Pair index -> manifest entry of all pairs
+    - shard_count (int): Number of node shards N
+    - shard_size (int): Number of pairs per repacked shard
+
+    Returns:
+    - dict: Pair index -> manifest entry pointing to the repacked shard
+    - list: Files of the node shards, to be removed once the manifest is written
+    """
+    shard_path = os.path.join(root, SHARD_DIR)
+    node_pattern = os.path.join(
+        shard_path, f"shard-*-of-{int(shard_count)}-" + "[0-9]" * 6
+    )
+    node_shards = sorted(glob.glob(node_pattern + ".tar"))
+    node_names = {os.path.basename(shard_file) for shard_file in node_shards}
+    if not node_names:
+        return entries, []
+
+    # Shards of an interrupted merge hold pairs no manifest entry points to
+    referenced = {entry.get("shard") for entry in entries.values()}
+    pattern = os.path.join(shard_path, "shard-" + "[0-9]" * 6)
+    for shard_file in glob.glob(pattern + ".tar"):
+        if os.path.basename(shard_file) not in referenced:
+            os.remove(shard_file)
+            os.remove(shard_file[: -len(".tar")] + ".json")
+
+    reader = ShardReader(root)
+    writer = ShardWriter(root, shard_size)
+    repacked = dict(entries)
+
+    def record(completed_entries):
+        for completed_entry in completed_entries:
+            repacked[completed_entry["index"]] = completed_entry
+
+    for index in sorted(entries):
+        entry = entries[index]
+        if entry.get("shard") not in node_names:
+            continue
+        pair_key = f"{entry['id_1']}_{entry['id_2']}"
+        # The writer adds the metadata with the new shard name
+        files = {
+            name: data
+            for name, data in reader.read_pair(pair_key).items()
+            if not name.startswith("meta/")
+        }
+        entry = {key: value for key, value in entry.items() if key != "shard"}
+        record(writer.add(entry, files))
+    record(writer.close())
+    open_shards.cache_clear()
+
+    node_files = node_shards + [
+        shard_file[: -len(".tar")] + ".json" for shard_file in node_shards
+    ]
+    return repacked, node_files
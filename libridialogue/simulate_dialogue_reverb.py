@@ -2,12 +2,22 @@ import random
 import numpy as np
 import pyroomacoustics as pra
 import soundfile as sf
-import uuid
-from libridialogue.util import stereo_to_mono
-import os
+from libridialogue.convolution import CONVOLVER, stack_rirs
+from libridialogue.util.audio_io import resample, write_wav
 from libridialogue import settings  # Import the settings module
 
 
+def normalize(signals, bits=16):
+    """
+    Normalize the signals jointly to full scale and convert them to integers,
+    like pyroomacoustics' to_wav(norm=True, bitdepth=np.int16)
+    """
+    signals = np.array(signals, dtype=np.float64)
+    signals /= np.abs(signals).max()
+    signals *= 2 ** (bits - 1) - 1
+    return signals.astype(np.int16)
+
+
 def simulate_libridialogue_reverb(
     audio_in_1,
     audio_in_2,
@@ -16,20 +26,27 @@ def simulate_libridialogue_reverb(
     audio_out_1,
     audio_out_2,
 ):
-
-    if not os.path.exists(os.path.dirname(audio_out_single_1)):
-        os.makedirs(os.path.dirname(audio_out_single_1))
-    if not os.path.exists(os.path.dirname(audio_out_single_2)):
-        os.makedirs(os.path.dirname(audio_out_single_2))
-    if not os.path.exists(os.path.dirname(audio_out_1)):
-        os.makedirs(os.path.dirname(audio_out_1))
-    if not os.path.exists(os.path.dirname(audio_out_2)):
-        os.makedirs(os.path.dirname(audio_out_2))
-
     # Import mono wavfiles as source signals
     audio1, fs = sf.read(audio_in_1)
     audio2, fs = sf.read(audio_in_2)
 
+    single_1, single_2, dual_1, dual_2 = simulate_reverb(audio1, audio2, fs)
+
+    write_wav(audio_out_single_1, single_1, fs)
+    write_wav(audio_out_single_2, single_2, fs)
+    write_wav(audio_out_1, dual_1, fs)
+    write_wav(audio_out_2, dual_2, fs)
+
+
+def sample_scene():
+    """
+    Draw the parameters of a random room with two speakers and two microphones
+
+    Returns:
+    - dict: room dimensions, temperature, humidity and the positions of both
+      sources and microphones
+    """
+
     # Use environment variables from settings
     min_temperature = float(settings.LIBRIDIALOGUE_ROOM_MIN_TEMPERATURE)
     max_temperature = float(settings.LIBRIDIALOGUE_ROOM_MAX_TEMPERATURE)
@@ -60,24 +77,9 @@ def simulate_libridialogue_reverb(
 
     rt60_tgt = float(settings.LIBRIDIALOGUE_ROOM_RT60_TGT)  # seconds
 
-    e_absorption, max_order = pra.inverse_sabine(
-        rt60_tgt, room_dim
-    )  # Invert Sabine's formula
-
     temperature_val = random.uniform(min_temperature, max_temperature)
     humidity_val = random.uniform(min_humidity, max_humidity)
 
-    room_kwargs = {
-        "p": room_dim,
-        "fs": fs,
-        "materials": pra.Material(e_absorption),
-        "max_order": max_order,
-        "air_absorption": True,
-        "ray_tracing": True,
-        "temperature": temperature_val,
-        "humidity": humidity_val,
-    }
-
     # Randomly place first source using steps
     source1_x = round(
         random.randint(0, num_steps_source_x - 1) * step_size_source + 1, 2
@@ -115,21 +117,6 @@ def simulate_libridialogue_reverb(
     mic1_z = source1_z - 0.1
     mic2_z = source2_z - 0.1
 
-    source_1_kwargs = {
-        "position": [source1_x, source1_y, source1_z],
-        "signal": audio1,
-        "delay": 0,
-    }
-
-    source_2_kwargs = {
-        "position": [source2_x, source2_y, source2_z],
-        "signal": audio2,
-        "delay": 0,
-    }
-
-    mic_1_position = [mic1_x, mic1_y, mic1_z]
-    mic_2_position = [mic2_x, mic2_y, mic2_z]
-
     # Print all randomized parameters
     # print("Randomized Parameters:")
     # print(f"Temperature: {temperature_val}")
@@ -141,51 +128,110 @@ def simulate_libridialogue_reverb(
     # print(f"Microphone 1 position: ({mic1_x}, {mic1_y}, {mic1_z})")
     # print(f"Microphone 2 position: ({mic2_x}, {mic2_y}, {mic2_z})")
 
-    # ==========================================
-    # Simulate first source and first microphone
-    # ==========================================
-    room_1 = pra.ShoeBox(**room_kwargs)
-    room_1.add_source(**source_1_kwargs)
-    mic_locs_1 = np.c_[mic_1_position]
-    room_1.add_microphone_array(mic_locs_1)
-    room_1.simulate(recompute_rir=True)
-    room_1.mic_array.to_wav(audio_out_single_1, norm=True, bitdepth=np.int16)
-    out, out_rate = sf.read(audio_out_single_1)
-    sf.write(audio_out_single_1, out[: len(audio1)], out_rate)
-
-    # ============================================
-    # Simulate second source and second microphone
-    # ============================================
-    room_2 = pra.ShoeBox(**room_kwargs)
-    room_2.add_source(**source_2_kwargs)
-    mic_locs_2 = np.c_[mic_2_position]
-    room_2.add_microphone_array(mic_locs_2)
-    room_2.simulate(recompute_rir=True)
-    room_2.mic_array.to_wav(audio_out_single_2, norm=True, bitdepth=np.int16)
-    out, out_rate = sf.read(audio_out_single_2)
-    sf.write(audio_out_single_2, out[: len(audio2)], out_rate)
-
-    # ========================================
-    # Simulate two sources and two microphones
-    # ========================================
-    room_3 = pra.ShoeBox(**room_kwargs)
-    room_3.add_source(**source_1_kwargs)
-    room_3.add_source(**source_2_kwargs)
-    mic_locs_3 = np.c_[mic_1_position, mic_2_position]
-    room_3.add_microphone_array(mic_locs_3)
-    room_3.simulate(recompute_rir=True)
-
-    # Create temp file to save the reverberated audio
-    tmp_file = f".tmp/{uuid.uuid4()}.wav"
-    if not os.path.exists(".tmp"):
-        os.makedirs(".tmp")
-
-    room_3.mic_array.to_wav(tmp_file, norm=True, bitdepth=np.int16)
-    stereo_to_mono.stereo_to_mono(tmp_file, audio_out_1, audio_out_2)
-    out, out_rate = sf.read(audio_out_1)
-    sf.write(audio_out_1, out[: len(audio2)], out_rate)
-    out, out_rate = sf.read(audio_out_2)
-    sf.write(audio_out_2, out[: len(audio2)], out_rate)
-
-    # Remove the tmp directory and its contents
-    os.system("rm -rf .tmp")
+    return {
+        "room_dim": room_dim,
+        "temperature": temperature_val,
+        "humidity": humidity_val,
+        "rt60_tgt": rt60_tgt,
+        "source_1_position": [source1_x, source1_y, source1_z],
+        "source_2_position": [source2_x, source2_y, source2_z],
+        "mic_1_position": [mic1_x, mic1_y, mic1_z],
+        "mic_2_position": [mic2_x, mic2_y, mic2_z],
+    }
+
+
+def compute_scene_rirs(scene, fs, fidelity=settings.LIBRIDIALOGUE_ROOM_FIDELITY):
+    """
+    Compute the 2x2 room impulse responses of a scene with a single room
+
+    Args:
+    - scene (dict): Scene parameters from sample_scene
+    - fs (int): Sample rate
+    - fidelity (str): Name of a tier in the fidelity_tiers room settings
+
+    Returns:
+    - list: rirs[mic][source] as 1D arrays
+    """
+    if fidelity not in settings.LIBRIDIALOGUE_ROOM_FIDELITY_TIERS:
+        raise ValueError(f"Unknown simulation fidelity {fidelity}")
+    tier = settings.LIBRIDIALOGUE_ROOM_FIDELITY_TIERS[fidelity]
+
+    e_absorption, max_order = pra.inverse_sabine(
+        scene["rt60_tgt"], scene["room_dim"]
+    )  # Invert Sabine's formula
+
+    # Cap the image source order of cheaper tiers
+    if tier["max_order"] is not None:
+        max_order = min(max_order, int(tier["max_order"]))
+
+    room = pra.ShoeBox(
+        p=scene["room_dim"],
+        fs=fs,
+        materials=pra.Material(e_absorption),
+        max_order=max_order,
+        air_absorption=bool(tier["air_absorption"]),
+        ray_tracing=bool(tier["ray_tracing"]),
+        temperature=scene["temperature"],
+        humidity=scene["humidity"],
+    )
+    room.add_source(scene["source_1_position"])
+    room.add_source(scene["source_2_position"])
+    room.add_microphone_array(np.c_[scene["mic_1_position"], scene["mic_2_position"]])
+    room.compute_rir()
+
+    return [[np.asarray(room.rir[m][s]) for s in range(2)] for m in range(2)]
+
+
+def resample_rirs(rirs, orig_fs, fs):
+    """
+    Derive the room impulse responses of a scene at another sample rate by
+    band-limited resampling
+    """
+    return [[resample(rir, orig_fs, fs) for rir in row] for row in rirs]
+
+
+def convolve_scene(rirs, audio1, audio2):
+    """
+    Apply the room impulse responses of a scene to the clean signals, the same way
+    pyroomacoustics mixes sources in Room.simulate
+
+    Returns:
+    - tuple: (single_1, single_2, dual_1, dual_2) normalized int16 signals,
+      truncated to the length of the clean signals
+    """
+    length = max(len(audio1), len(audio2))
+    audio = np.zeros((1, 2, length), dtype=np.float32)
+    audio[0, 0, : len(audio1)] = audio1
+    audio[0, 1, : len(audio2)] = audio2
+
+    # premix[mic, source]
+    premix = CONVOLVER.convolve(audio, stack_rirs(rirs)[None])[0]
+
+    # Source 1 at microphone 1 and source 2 at microphone 2
+    single_1 = normalize(premix[0, 0])[: len(audio1)]
+    single_2 = normalize(premix[1, 1])[: len(audio2)]
+
+    # Both sources at both microphones
+    dual = normalize(premix.sum(axis=1))[:, : len(audio2)]
+
+    return single_1, single_2, dual[0], dual[1]
+
+
+def simulate_reverb(audio1, audio2, fs):
+    """
+    Simulate a random room with two speakers and two microphones in memory.
+    The room impulse responses are computed once and shared by the solo and dual
+    outputs.
+
+    Args:
+    - audio1 (np.ndarray): Clean signal of the first speaker
+    - audio2 (np.ndarray): Clean signal of the second speaker
+    - fs (int): Sample rate of the signals
+
+    Returns:
+    - tuple: (single_1, single_2, dual_1, dual_2) normalized int16 signals,
+      truncated to the length of the clean signals
+    """
+    scene = sample_scene()
+    rirs = compute_scene_rirs(scene, fs)
+    return convolve_scene(rirs, audio1, audio2)
@@ -5,154 +5,481 @@ import torchaudio
 from transformers import pipeline
 import torch
 import string
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from tqdm import tqdm
 import pandas as pd
+import soundfile as sf
 from torchmetrics.audio import ScaleInvariantSignalNoiseRatio
 from torchmetrics.audio import ShortTimeObjectiveIntelligibility
-from torchmetrics.audio import (
-    SignalDistortionRatio,
-)  # Import SDR and SIR
 from libridialogue import settings
+from libridialogue.shards import file_exists, list_files, open_file
+from libridialogue.util.audio_io import read_audio, resample
+from libridialogue.util.bss_eval import bss_eval
+from libridialogue.util.transcript_cache import TranscriptCache, content_hash
 import numpy as np
 
+# Metric objects and resamplers of the current process, created once per worker
+_metric_state = {}
 
-def analyze_with_channel_duplicates(
-    file_path: str, target_path: str, csv_path: str, rate: int
-):
-    dataset = []
-    with open(csv_path, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
 
-        for row in reader:
-            dataset.append(row)
+def select_device(device=settings.ANALYZE_ASR_DEVICE):
+    """
+    Resolve "auto" to the fastest available device: CUDA, then MPS, then CPU
+    """
+    if device != "auto":
+        return torch.device(device)
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
 
-    file_list = os.listdir(file_path)
-    file_list = [file for file in file_list if file != ".DS_Store"]
 
-    pipe = pipeline(
+def asr_options(device=settings.ANALYZE_ASR_DEVICE):
+    """
+    Decoding options of the pipeline, half precision on CUDA
+    """
+    device = select_device(device)
+    return {
+        "return_timestamps": True,
+        "torch_dtype": "float16" if device.type == "cuda" else "float32",
+    }
+
+
+@lru_cache(maxsize=None)
+def load_asr_pipeline(
+    model=settings.ANALYZE_ASR_MODEL, device=settings.ANALYZE_ASR_DEVICE
+):
+    """
+    Whisper pipeline on the selected device, loaded once per process
+    """
+    options = asr_options(device)
+    return pipeline(
         "automatic-speech-recognition",
-        model="openai/whisper-medium",
-        device=torch.device("mps"),
-        return_timestamps=True,
+        model=model,
+        device=select_device(device),
+        torch_dtype=getattr(torch, options["torch_dtype"]),
+        return_timestamps=options["return_timestamps"],
     )
 
+
+def transcribe(
+    file_path,
+    file_list,
+    batch_size=settings.ANALYZE_ASR_BATCH_SIZE,
+    cache=None,
+    model=settings.ANALYZE_ASR_MODEL,
+    hashes=None,
+):
+    """
+    Transcribe files in batches. The files are sorted by duration, so the signals
+    of a batch have similar lengths and little padding. Files found in the
+    transcript cache are not transcribed, the model is only loaded if a file is
+    missing.
+
+    Returns:
+    - dict: File name -> transcript in upper case without punctuation
+    """
     translator = str.maketrans("", "", string.punctuation.replace("'", ""))
+    options = asr_options()
+
+    texts = {}
+    hashes = {} if hashes is None else hashes
+    missing = []
+    for file in file_list:
+        if cache is not None:
+            if file not in hashes:
+                hashes[file] = content_hash(open_file(file_path, file))
+            text = cache.get(hashes[file], model, options)
+            if text is not None:
+                texts[file] = text
+                continue
+        missing.append(file)
+
+    # Longest first, an out of memory error shows up in the first batch
+    durations = {file: sf.info(open_file(file_path, file)).duration for file in missing}
+    ordered = sorted(missing, key=durations.get, reverse=True)
+
+    with tqdm(total=len(ordered), desc="Transcribing files") as progress:
+        for start in range(0, len(ordered), batch_size):
+            batch = ordered[start : start + batch_size]
+            inputs = []
+            for file in batch:
+                audio, rate = read_audio(open_file(file_path, file))
+                inputs.append({"raw": audio, "sampling_rate": rate})
+
+            pipe = load_asr_pipeline(model)
+            results = pipe(inputs, batch_size=len(inputs))
+            for file, result in zip(batch, results):
+                texts[file] = result["text"]
+            if cache is not None:
+                cache.put_many(
+                    [(hashes[file], texts[file]) for file in batch], model, options
+                )
+            progress.update(len(batch))
 
-    transcripts = {}
+    if cache is not None:
+        stats = cache.stats()
+        print(
+            f"Transcript cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['entries']} entries"
+        )
 
-    for file in tqdm(file_list, desc="Transcribing files"):
-        result = pipe(os.path.join(file_path, file))
-        transcript = result["text"].upper().translate(translator)
-        transcripts[os.path.basename(file)] = transcript
+    return {
+        os.path.basename(file): text.upper().translate(translator)
+        for file, text in texts.items()
+    }
 
-    speakers = set()
 
-    for key in transcripts.keys():
-        speakers.add(key.split("_")[0])
+def init_metric_worker(num_threads=None):
+    """
+    Create the metric objects of a process. Pool workers compute single-threaded,
+    the parallelism comes from the pool.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    _metric_state["si_snr"] = ScaleInvariantSignalNoiseRatio()
+    _metric_state["stoi"] = {}
+    _metric_state["resample"] = {}
 
-    mers = []
 
-    for speaker in speakers:
-        speaker_files = [file for file in transcripts.keys() if speaker in file]
-        speaker_transcripts = [transcripts[file] for file in speaker_files]
-        speaker_mers = []
-        truth = next((entry for entry in dataset if entry.get("id") == speaker), None)
+def target_name(file):
+    """
+    Name of the reverb-solo target of a file, the channel suffix of separated
+    outputs is dropped
+    """
+    return file.replace("-1", "").replace("-2", "")
 
-        for speaker_transcript in speaker_transcripts:
-            speaker_mer = jiwer.process_words(truth["text"], speaker_transcript).mer
-            speaker_mers.append(speaker_mer)
 
-        mers.append(min(speaker_mers))
+def compute_file_metrics(file_path, target_path, file):
+    """
+    SI-SNR and STOI of a file against its target with the metric objects of the
+    current process
 
-    mean_mer = sum(mers) / len(mers)
+    Returns:
+    - tuple: (si_snr, stoi), None if the file is skipped
+    """
+    if not _metric_state:
+        init_metric_worker()
+
+    name = target_name(file)
+    if not file_exists(target_path, name):
+        target_file = os.path.join(target_path, name)
+        print(f"Warning: Target file {target_file} does not exist. Skipping.")
+        return None
+
+    pred, pred_rate = torchaudio.load(open_file(file_path, file))
+    target, target_rate = torchaudio.load(open_file(target_path, name))
+
+    # Ensure signals are not empty
+    if pred.shape[-1] == 0 or target.shape[-1] == 0:
+        print(f"Warning: Empty audio signal detected. Skipping {file}.")
+        return None
+
+    # Convert to mono if necessary
+    if pred.shape[0] > 1:
+        pred = torch.mean(pred, dim=0, keepdim=True)
+    if target.shape[0] > 1:
+        target = torch.mean(target, dim=0, keepdim=True)
+
+    # Ensure same sampling rate, the resampling kernels are kept per rate pair
+    if pred_rate != target_rate:
+        resamplers = _metric_state["resample"]
+        if (pred_rate, target_rate) not in resamplers:
+            resamplers[(pred_rate, target_rate)] = torchaudio.transforms.Resample(
+                orig_freq=pred_rate, new_freq=target_rate
+            )
+        pred = resamplers[(pred_rate, target_rate)](pred)
 
-    si_snrs = []
-    stois = []
-    sdrs = []
-    sirs = []
+    # Truncate to the same length
+    min_length = min(pred.shape[-1], target.shape[-1])
+    pred = pred[..., :min_length]
+    target = target[..., :min_length]
 
-    for speaker in speakers:
-        speaker_files = [
-            file for file in transcripts.keys() if file.startswith(speaker)
+    stoi_metrics = _metric_state["stoi"]
+    if target_rate not in stoi_metrics:
+        stoi_metrics[target_rate] = ShortTimeObjectiveIntelligibility(
+            fs=target_rate, extended=False
+        )
+
+    values = []
+    for metric, args in (
+        (_metric_state["si_snr"], (pred.unsqueeze(0), target.unsqueeze(0))),
+        (stoi_metrics[target_rate], (pred, target)),
+    ):
+        values.append(metric(*args).item())
+        # The metric objects are reused, drop the accumulated state
+        metric.reset()
+
+    return tuple(values)
+
+
+def compute_metrics_chunk(file_path, target_path, files):
+    """
+    Returns:
+    - list: (file, (si_snr, stoi)) of the files that are not skipped
+    """
+    results = []
+    for file in files:
+        values = compute_file_metrics(file_path, target_path, file)
+        if values is not None:
+            results.append((file, values))
+    return results
+
+
+def run_chunks(function, file_path, target_path, chunks, num_workers, desc):
+    """
+    Run function(file_path, target_path, chunk) for all chunks, in this process
+    or on a pool of worker processes. Only the scalar results are sent back.
+
+    Returns:
+    - dict: File name -> metric values
+    """
+    metrics = {}
+
+    if num_workers <= 1:
+        for chunk in tqdm(chunks, desc=desc):
+            metrics.update(function(file_path, target_path, chunk))
+        return metrics
+
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=init_metric_worker, initargs=(1,)
+    ) as executor:
+        futures = [
+            executor.submit(function, file_path, target_path, chunk) for chunk in chunks
         ]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            metrics.update(future.result())
 
-        speaker_si_snrs = []
-        speaker_stois = []
-        speaker_sdrs = []
+    return metrics
 
-        for speaker_file in speaker_files:
-            target_file = os.path.join(
-                target_path, speaker_file.replace("-1", "").replace("-2", "")
-            )
-            if not os.path.exists(target_file):
-                print(f"Warning: Target file {target_file} does not exist. Skipping.")
-                continue
 
-            pred, pred_rate = torchaudio.load(os.path.join(file_path, speaker_file))
-            target, target_rate = torchaudio.load(target_file)
+def evaluate_metrics(
+    file_path,
+    target_path,
+    files,
+    num_workers=settings.ANALYZE_NUM_WORKERS,
+    chunk_size=settings.ANALYZE_METRIC_CHUNK_SIZE,
+):
+    """
+    Compute the signal metrics of all files, in chunks on a pool of worker
+    processes
+
+    Returns:
+    - dict: File name -> (si_snr, stoi)
+    """
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+    return run_chunks(
+        compute_metrics_chunk,
+        file_path,
+        target_path,
+        chunks,
+        num_workers,
+        "Computing metrics",
+    )
 
-            # Ensure signals are not empty
-            if pred.shape[-1] == 0 or target.shape[-1] == 0:
-                print(f"Warning: Empty audio signal detected. Skipping {speaker_file}.")
-                continue
 
-            # Convert to mono if necessary
-            if pred.shape[0] > 1:
-                pred = torch.mean(pred, dim=0, keepdim=True)
-            if target.shape[0] > 1:
-                target = torch.mean(target, dim=0, keepdim=True)
+def load_bss_pair(file_path, target_path, pair, pair_files):
+    """
+    Decode the estimates of a pair and both of its reverb-solo references
+
+    Returns:
+    - tuple: (estimates, references, targets) truncated to a common length, None
+      if the pair is skipped
+    """
+    id_a, id_b = pair
+    names = [f"{id_a}_{id_b}.wav", f"{id_b}_{id_a}.wav"]
+    if not all(file_exists(target_path, name) for name in names):
+        print(f"Warning: References of {id_a}_{id_b} do not exist. Skipping.")
+        return None
+
+    references = []
+    for name in names:
+        reference, rate = read_audio(open_file(target_path, name))
+        references.append(reference)
+    estimates = []
+    for file in pair_files:
+        estimate, estimate_rate = read_audio(open_file(file_path, file))
+        estimates.append(resample(estimate, estimate_rate, rate))
+
+    length = min(len(signal) for signal in references + estimates)
+    if length == 0:
+        print(f"Warning: Empty audio signal detected. Skipping {id_a}_{id_b}.")
+        return None
+    targets = [0 if file_speakers(file)[0] == id_a else 1 for file in pair_files]
+    return (
+        np.stack([signal[:length] for signal in estimates]),
+        np.stack([signal[:length] for signal in references]),
+        np.array(targets),
+    )
+
+
+def compute_bss_chunk(file_path, target_path, chunk):
+    """
+    BSS-Eval of a chunk of pairs with the same number of files, the pairs are
+    only decoded when their chunk is evaluated
 
-            # Ensure same sampling rate
-            if pred_rate != target_rate:
-                resample_transform = torchaudio.transforms.Resample(
-                    orig_freq=pred_rate, new_freq=target_rate
+    Returns:
+    - list: (file, (sdr, sir, sar)) of the files that are not skipped
+    """
+    items = []
+    for pair, pair_files in chunk:
+        item = load_bss_pair(file_path, target_path, pair, pair_files)
+        if item is not None:
+            items.append((pair_files,) + item)
+    if not items:
+        return []
+
+    length = max(item[1].shape[-1] for item in items)
+    estimates = np.zeros((len(items), len(items[0][0]), length), dtype=np.float32)
+    references = np.zeros((len(items), 2, length), dtype=np.float32)
+    for index, (_, item_estimates, item_references, _) in enumerate(items):
+        estimates[index, :, : item_estimates.shape[-1]] = item_estimates
+        references[index, :, : item_references.shape[-1]] = item_references
+    targets = np.stack([item[3] for item in items])
+
+    sdr, sir, sar = bss_eval(estimates, references, targets)
+    results = []
+    for index, item in enumerate(items):
+        for k, file in enumerate(item[0]):
+            results.append(
+                (
+                    file,
+                    (float(sdr[index, k]), float(sir[index, k]), float(sar[index, k])),
                 )
-                pred = resample_transform(pred)
-                pred_rate = target_rate  # Update pred_rate
-
-            # Truncate to the same length
-            min_length = min(pred.shape[-1], target.shape[-1])
-            pred = pred[..., :min_length]
-            target = target[..., :min_length]
-
-            # Initialize metrics
-            si_snr_metric = ScaleInvariantSignalNoiseRatio()
-            stoi_metric = ShortTimeObjectiveIntelligibility(
-                fs=target_rate, extended=False
             )
-            sdr_metric = SignalDistortionRatio()
-
-            # Compute SI-SNR
-            speaker_si_snr = si_snr_metric(
-                pred.unsqueeze(0), target.unsqueeze(0)
-            ).item()
-            speaker_si_snrs.append(speaker_si_snr)
-
-            # Compute STOI
-            # Convert tensors to numpy arrays for STOI computation
-            pred_np = pred.squeeze().numpy()
-            target_np = target.squeeze().numpy()
-
-            # Ensure the signals are in the correct shape (batch, time)
-            pred_np = pred_np[np.newaxis, :]
-            target_np = target_np[np.newaxis, :]
-
-            # Compute STOI
-            speaker_stoi = stoi_metric(
-                torch.from_numpy(pred_np), torch.from_numpy(target_np)
-            ).item()
-            speaker_stois.append(speaker_stoi)
-
-            # Compute SDR
-            speaker_sdr = sdr_metric(pred.unsqueeze(0), target.unsqueeze(0)).item()
-            speaker_sdrs.append(speaker_sdr)
-
-        if speaker_si_snrs:
-            si_snrs.append(max(speaker_si_snrs))
-        if speaker_stois:
-            stois.append(max(speaker_stois))
-        if speaker_sdrs:
-            sdrs.append(max(speaker_sdrs))
+    return results
+
+
+def evaluate_bss(
+    file_path,
+    target_path,
+    files,
+    batch_size=settings.ANALYZE_BSS_BATCH_SIZE,
+    num_workers=settings.ANALYZE_NUM_WORKERS,
+):
+    """
+    BSS-Eval SDR, SIR and SAR of all files. The references of a file
+    {id_1}_{id_2} are both reverb-solo signals of its pair, {id_1}_{id_2} as
+    target and {id_2}_{id_1} as interferer. All files of a pair are evaluated
+    together, pairs with the same number of files are batched. The batches are
+    decoded and evaluated one at a time on a pool of worker processes.
+
+    Returns:
+    - dict: File name -> (sdr, sir, sar)
+    """
+    pairs = {}
+    for file in files:
+        id_1, id_2 = file_speakers(file)
+        pairs.setdefault(tuple(sorted((id_1, id_2))), []).append(file)
+
+    # Similar lengths in a batch keep the zero padding small, it does not change
+    # the results. Only the headers are read to sort the pairs.
+    frames = {
+        pair: sf.info(open_file(file_path, pair_files[0])).frames
+        for pair, pair_files in pairs.items()
+    }
+    groups = {}
+    for pair in sorted(pairs, key=frames.get):
+        groups.setdefault(len(pairs[pair]), []).append((pair, pairs[pair]))
+    chunks = [
+        group[i : i + batch_size]
+        for group in groups.values()
+        for i in range(0, len(group), batch_size)
+    ]
+
+    return run_chunks(
+        compute_bss_chunk,
+        file_path,
+        target_path,
+        chunks,
+        num_workers,
+        "Computing BSS-Eval",
+    )
+
+
+FILE_METRIC_COLUMNS = [
+    "path",
+    "file",
+    "audio_hash",
+    "target_hash",
+    "id_1",
+    "id_2",
+    "transcript",
+    "mer_1",
+    "mer_2",
+    "si_snr",
+    "stoi",
+    "sdr",
+    "sir",
+    "sar",
+]
+
+
+def file_speakers(file):
+    """
+    Ids of the speakers of a file named {id_1}_{id_2}.wav or {id_1}_{id_2}-1.wav
+    """
+    stem = os.path.splitext(os.path.basename(file))[0]
+    id_1, id_2 = stem.split("-")[0].split("_")[:2]
+    return id_1, id_2
+
+
+def load_file_metrics(table_path=settings.ANALYSIS_FILES):
+    if os.path.exists(table_path):
+        table = pd.read_parquet(table_path)
+        # Tables without all metrics are evaluated again
+        if set(FILE_METRIC_COLUMNS) <= set(table.columns):
+            return table
+    return pd.DataFrame(columns=FILE_METRIC_COLUMNS)
+
+
+def store_file_metrics(table, table_path=settings.ANALYSIS_FILES):
+    if os.path.dirname(table_path):
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+    partial_path = table_path + ".partial"
+    table.to_parquet(partial_path, index=False)
+    os.replace(partial_path, table_path)
+
+
+def aggregate_file_metrics(rows):
+    """
+    Dataset means over speakers from the per-file rows. Per speaker, the best MER
+    over all files containing the speaker and the best signal metrics over the
+    files of the speaker's channel are taken.
+    """
+    # Speaker id -> MERs and signal metrics of its files
+    mer_index = {}
+    metric_index = {}
+    bss_index = {}
+    for row in rows.itertuples(index=False):
+        mer_index.setdefault(row.id_1, []).append(row.mer_1)
+        mer_index.setdefault(row.id_2, []).append(row.mer_2)
+        if not pd.isna(row.si_snr):
+            metric_index.setdefault(row.id_1, []).append((row.si_snr, row.stoi))
+        if not pd.isna(row.sdr):
+            bss_index.setdefault(row.id_1, []).append((row.sdr, row.sir))
+
+    speakers = set(rows["id_1"])
+
+    mers = [min(mer_index[speaker]) for speaker in speakers]
+    mean_mer = sum(mers) / len(mers)
+
+    si_snrs = []
+    stois = []
+    sdrs = []
+    sirs = []
+
+    for speaker in speakers:
+        speaker_metrics = metric_index.get(speaker)
+        if speaker_metrics:
+            si_snrs.append(max(values[0] for values in speaker_metrics))
+            stois.append(max(values[1] for values in speaker_metrics))
+        speaker_bss = bss_index.get(speaker)
+        if speaker_bss:
+            sdrs.append(max(values[0] for values in speaker_bss))
+            sirs.append(max(values[1] for values in speaker_bss))
 
     mean_si_snr = 0 if not si_snrs else sum(si_snrs) / len(si_snrs)
     mean_stoi = 0 if not stois else sum(stois) / len(stois)
@@ -162,6 +489,89 @@ def analyze_with_channel_duplicates(
     return mean_mer, mean_si_snr, mean_stoi, mean_sdr, mean_sir
 
 
+def analyze_with_channel_duplicates(
+    file_path: str, target_path: str, csv_path: str, rate: int
+):
+    with open(csv_path, newline="", encoding="utf-8") as csvfile:
+        truths = {row["id"]: row["text"] for row in csv.DictReader(csvfile)}
+
+    file_list = list_files(file_path)
+    # only complete outputs, not .DS_Store or files cut off before their rename
+    file_list = [file for file in file_list if file.endswith(".wav")]
+
+    hashes = {file: content_hash(open_file(file_path, file)) for file in file_list}
+    target_hashes = {}
+    for file in file_list:
+        name = target_name(file)
+        if file_exists(target_path, name):
+            target_hashes[file] = content_hash(open_file(target_path, name))
+
+    # Rows of unchanged files and targets are reused, the rest is evaluated
+    table = load_file_metrics()
+    stored = {
+        row["file"]: row for row in table[table["path"] == file_path].to_dict("records")
+    }
+    kept = []
+    changed = []
+    for file in file_list:
+        row = stored.get(file)
+        if (
+            row is not None
+            and row["audio_hash"] == hashes[file]
+            # A missing target is stored as NaN
+            and (None if pd.isna(row["target_hash"]) else row["target_hash"])
+            == target_hashes.get(file)
+        ):
+            kept.append(row)
+        else:
+            changed.append(file)
+    print(f"Analyzing {len(changed)} new or changed of {len(file_list)} files")
+
+    cache = None
+    if settings.ANALYZE_ASR_CACHE:
+        cache = TranscriptCache(settings.ANALYZE_ASR_CACHE)
+    try:
+        transcripts = transcribe(file_path, changed, cache=cache, hashes=hashes)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    metrics = evaluate_metrics(file_path, target_path, changed)
+    bss_metrics = evaluate_bss(file_path, target_path, changed)
+
+    rows = []
+    for file in changed:
+        id_1, id_2 = file_speakers(file)
+        transcript = transcripts[os.path.basename(file)]
+        si_snr, stoi = metrics.get(file, (None, None))
+        sdr, sir, sar = bss_metrics.get(file, (None, None, None))
+        rows.append(
+            {
+                "path": file_path,
+                "file": file,
+                "audio_hash": hashes[file],
+                "target_hash": target_hashes.get(file),
+                "id_1": id_1,
+                "id_2": id_2,
+                "transcript": transcript,
+                "mer_1": jiwer.process_words(truths[id_1], transcript).mer,
+                "mer_2": jiwer.process_words(truths[id_2], transcript).mer,
+                "si_snr": si_snr,
+                "stoi": stoi,
+                "sdr": sdr,
+                "sir": sir,
+                "sar": sar,
+            }
+        )
+
+    rows = pd.DataFrame(kept + rows, columns=FILE_METRIC_COLUMNS)
+    # Files removed from the dataset are dropped from the table
+    table = pd.concat([table[table["path"] != file_path], rows], ignore_index=True)
+    store_file_metrics(table)
+
+    return aggregate_file_metrics(rows)
+
+
 def analyze(
     file_path: str,
     target_path: str,
@@ -0,0 +1,118 @@
+import io
+import os
+import math
+import queue
+import threading
+import numpy as np
+import soundfile as sf
+from functools import lru_cache
+from scipy.signal import firwin, resample_poly
+from libridialogue.librispeech.archive import open_source
+
+
+def read_audio(audio_path, dtype="float32"):
+    """
+    Read an audio file, also from inside a LibriSpeech archive, as a mono array
+    with its sample rate
+    """
+    audio, rate = sf.read(open_source(audio_path), dtype=dtype)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1).astype(dtype)
+    return audio, rate
+
+
+def write_wav(audio_path, audio, rate):
+    """
+    Write an array as 16 bit wav file, creating the output directory if necessary.
+    The file is written to a temporary name and renamed, so it is either complete
+    or missing.
+    """
+    if os.path.dirname(audio_path) and not os.path.exists(os.path.dirname(audio_path)):
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+
+    if np.issubdtype(audio.dtype, np.floating):
+        audio = np.clip(audio, -1.0, 1.0)
+    partial_path = audio_path + ".partial"
+    sf.write(partial_path, audio, rate, subtype="PCM_16", format="WAV")
+    os.replace(partial_path, audio_path)
+
+
+class BackgroundWriter:
+    """
+    Write wav files on a background thread while the caller continues with the
+    next batch. The queue is bounded, so a slow disk blocks the caller instead of
+    filling the memory.
+    """
+
+    def __init__(self, max_pending=64):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # After an error the remaining files are dropped
+            if self.error is None:
+                try:
+                    write_wav(*item)
+                except Exception as error:
+                    self.error = error
+
+    def write(self, audio_path, audio, rate):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((audio_path, audio, rate))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def encode_wav(audio, rate):
+    """
+    Encode an array as 16 bit wav file in memory
+    """
+    if np.issubdtype(audio.dtype, np.floating):
+        audio = np.clip(audio, -1.0, 1.0)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, rate, subtype="PCM_16", format="WAV")
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def resample_filter(up, down):
+    """
+    Anti-aliasing filter of resample_poly for a rate ratio, designed once
+    """
+    max_rate = max(up, down)
+    return firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+
+
+def resample(audio, orig_rate, target_rate, axis=-1):
+    """
+    Band-limited polyphase resampling
+    """
+    if orig_rate == target_rate:
+        return audio
+    gcd = math.gcd(int(orig_rate), int(target_rate))
+    up = int(target_rate) // gcd
+    down = int(orig_rate) // gcd
+    return resample_poly(
+        audio,
+        up,
+        down,
+        axis=axis,
+        window=resample_filter(up, down).astype(audio.dtype),
+    ).astype(audio.dtype)
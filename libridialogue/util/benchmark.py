@@ -0,0 +1,349 @@
+import os
+import random
+import tempfile
+from time import time
+
+import numpy as np
+import pandas as pd
+import pyroomacoustics as pra
+
+from libridialogue import settings
+from libridialogue.convolution import BatchConvolver, stack_rirs
+from libridialogue.generate import (
+    build_libridialogue_clean,
+    build_libridialogue_clean_mixes,
+    load_utterances,
+    rate_label,
+    sample_pairs,
+)
+from libridialogue.simulate_dialogue_reverb import (
+    compute_scene_rirs,
+    convolve_scene,
+    sample_scene,
+)
+from libridialogue.shards import list_files
+from libridialogue.util.audio_io import read_audio, resample, write_wav
+from libridialogue.util.bss_eval import bss_eval
+from libridialogue.util.seeding import derive_seed, seed_all
+
+
+def record_computation_time(id, file_count, computation_time):
+    """
+    Append a benchmark result to the computation times csv
+    """
+    if os.path.exists(settings.COMPUTATION_TIMES_CSV):
+        df = pd.read_csv(settings.COMPUTATION_TIMES_CSV)
+    else:
+        df = pd.DataFrame(columns=["id", "timestamp", "file_count", "computation_time"])
+
+    result = pd.DataFrame(
+        {
+            "id": id,
+            "timestamp": pd.Timestamp.now(),
+            "file_count": file_count,
+            "computation_time": computation_time,
+        },
+        index=[0],
+    )
+    df = pd.concat([df, result], ignore_index=True)
+    df.to_csv(settings.COMPUTATION_TIMES_CSV, index=False)
+
+
+def benchmark_clean_mix(librispeech_path, num_pairs=50, sample_rates=(8000, 16000)):
+    """
+    Compare the pydub clean mix builder with the NumPy builder on the same pairs.
+    Both paths write their outputs to a temporary directory.
+    """
+    utterances = load_utterances(librispeech_path)
+    paths = utterances["audiopath"].to_numpy()
+    pairs = sample_pairs(len(paths), num_pairs, random.Random(settings.RANDOM_SEED))
+    file_count = num_pairs * len(sample_rates) * 2
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time()
+        for index, (i, j) in enumerate(pairs):
+            for rate in sample_rates:
+                build_libridialogue_clean(
+                    paths[i],
+                    paths[j],
+                    f"{tmp_dir}/pydub/{rate}/{index}_1.wav",
+                    f"{tmp_dir}/pydub/{rate}/{index}_2.wav",
+                    rate,
+                )
+        pydub_time = time() - start
+
+        start = time()
+        for index, (i, j) in enumerate(pairs):
+            mixes, _ = build_libridialogue_clean_mixes(paths[i], paths[j], sample_rates)
+            for rate, (audio_1, audio_2) in mixes.items():
+                write_wav(f"{tmp_dir}/numpy/{rate}/{index}_1.wav", audio_1, rate)
+                write_wav(f"{tmp_dir}/numpy/{rate}/{index}_2.wav", audio_2, rate)
+        numpy_time = time() - start
+
+    print(f"pydub clean mix: {pydub_time:.2f}s for {num_pairs} pairs")
+    print(f"numpy clean mix: {numpy_time:.2f}s for {num_pairs} pairs")
+    print(f"speedup: {pydub_time / numpy_time:.2f}x")
+
+    record_computation_time("clean-mix-pydub", file_count, pydub_time)
+    record_computation_time("clean-mix-numpy", file_count, numpy_time)
+
+    return pydub_time, numpy_time
+
+
+def benchmark_convolution(num_signals=32, duration=10.0, fs=16000):
+    """
+    Throughput of applying the room impulse responses of a scene to two source
+    signals with the batched convolver and with pyroomacoustics' Room.simulate
+    """
+    seed_all(0)
+    scene = sample_scene()
+    rirs = compute_scene_rirs(scene, fs)
+    length = int(duration * fs)
+    signals = np.random.randn(num_signals, 2, length).astype(np.float32)
+    num_samples = signals.size
+
+    # pyroomacoustics convolves one room, and thereby one pair of signals, at a time
+    room = pra.ShoeBox(scene["room_dim"], fs=fs)
+    room.add_source(scene["source_1_position"])
+    room.add_source(scene["source_2_position"])
+    room.add_microphone_array(np.c_[scene["mic_1_position"], scene["mic_2_position"]])
+    room.rir = rirs
+    start = time()
+    for signal in signals:
+        room.sources[0].signal = signal[0]
+        room.sources[1].signal = signal[1]
+        room.simulate(recompute_rir=False)
+    pra_time = time() - start
+
+    convolver = BatchConvolver(dtype=np.float32)
+    stacked_rirs = stack_rirs(rirs)
+    batch_rirs = np.broadcast_to(stacked_rirs, (num_signals,) + stacked_rirs.shape)
+    # Warm up the FFT plans and buffers
+    convolver.convolve(signals, batch_rirs)
+    start = time()
+    convolver.convolve(signals, batch_rirs)
+    batch_time = time() - start
+
+    print(f"pyroomacoustics: {num_samples / pra_time:.3e} samples/s")
+    print(f"batched fft:     {num_samples / batch_time:.3e} samples/s")
+    print(f"speedup: {pra_time / batch_time:.2f}x")
+
+    record_computation_time("convolution-pyroomacoustics", num_signals, pra_time)
+    record_computation_time("convolution-batched", num_signals, batch_time)
+
+    return num_samples / pra_time, num_samples / batch_time
+
+
+def si_snr(estimate, target):
+    """
+    Scale-invariant signal-to-noise ratio in dB of two 1D signals
+    """
+    estimate = estimate - estimate.mean()
+    target = target - target.mean()
+    projection = np.dot(estimate, target) / np.dot(target, target) * target
+    noise = estimate - projection
+    return 10 * np.log10(np.dot(projection, projection) / np.dot(noise, noise))
+
+
+def separation_metrics(estimates, references, target):
+    """
+    BSS-Eval SDR and SIR of the estimate of the target speaker of a mixture. The
+    estimates are assigned to the references in the order with the higher mean
+    SDR, as the order of the separator outputs is arbitrary.
+
+    Args:
+    - estimates (np.ndarray): (2, samples) separated signals
+    - references (np.ndarray): (2, samples) reverb-solo signals
+    - target (int): Index of the reference of the mixture's speaker
+
+    Returns:
+    - tuple: (sdr, sir) in dB
+    """
+    length = min(estimates.shape[-1], references.shape[-1])
+    # Both estimates are scored against both orders of the references at once
+    sdr, sir, _ = bss_eval(
+        np.concatenate([estimates, estimates])[None, :, :length],
+        references[None, :, :length],
+        np.array([[0, 1, 1, 0]]),
+    )
+    k = target if sdr[0, :2].mean() >= sdr[0, 2:].mean() else 3 - target
+    return float(sdr[0, k]), float(sir[0, k])
+
+
+def benchmark_fidelity(
+    librispeech_path=settings.LIBRISPEECH_PATH + "/test-clean",
+    num_scenes=10,
+    fs=16000,
+    tiers=None,
+    model=None,
+):
+    """
+    Compare the simulation fidelity tiers on the same scenes and utterance pairs.
+    Reports the wall time per scene, the RT60 error against rt60_tgt, the SI-SNR
+    of the reverb-dual signals against the reverb-solo references, which is the
+    starting point of every separator, and the BSS-Eval SDR and SIR after
+    separating the reverb-dual signals with ConvTasNet.
+    """
+    from asteroid.models import BaseModel
+
+    from libridialogue.util.separate_asteroid import CONVTASNET_MODELS, separate_batch
+
+    if tiers is None:
+        tiers = list(settings.LIBRIDIALOGUE_ROOM_FIDELITY_TIERS)
+    if model is None:
+        model = CONVTASNET_MODELS[fs]
+    separator = BaseModel.from_pretrained(model)
+    separator.eval()
+
+    utterances = load_utterances(librispeech_path)
+    paths = utterances["audiopath"].to_numpy()
+    pairs = sample_pairs(len(paths), num_scenes, random.Random(settings.RANDOM_SEED))
+    signals = []
+    for i, j in pairs:
+        audio_1, rate_1 = read_audio(paths[i])
+        audio_2, rate_2 = read_audio(paths[j])
+        signals.append((resample(audio_1, rate_1, fs), resample(audio_2, rate_2, fs)))
+
+    rt60_tgt = float(settings.LIBRIDIALOGUE_ROOM_RT60_TGT)
+    results = []
+    for tier in tiers:
+        times = []
+        rt60_errors = []
+        input_si_snrs = []
+        mixtures = []
+        references = []
+        for index, (audio_1, audio_2) in enumerate(signals):
+            # Every tier sees the same scenes
+            seed_all(derive_seed(settings.RANDOM_SEED, "benchmark-fidelity", index))
+            scene = sample_scene()
+
+            start = time()
+            rirs = compute_scene_rirs(scene, fs, tier)
+            times.append(time() - start)
+
+            for m in range(2):
+                for s in range(2):
+                    rt60 = pra.experimental.measure_rt60(rirs[m][s], fs=fs)
+                    rt60_errors.append(abs(rt60 - rt60_tgt))
+
+            length = min(len(audio_1), len(audio_2))
+            single_1, single_2, dual_1, dual_2 = convolve_scene(
+                rirs, audio_1[:length], audio_2[:length]
+            )
+            input_si_snrs.append(si_snr(dual_1 / 32768.0, single_1 / 32768.0))
+            input_si_snrs.append(si_snr(dual_2 / 32768.0, single_2 / 32768.0))
+            mixtures += [
+                (dual_1 / 32768.0).astype(np.float32),
+                (dual_2 / 32768.0).astype(np.float32),
+            ]
+            references += [np.stack([single_1, single_2]) / 32768.0] * 2
+
+        separation = []
+        batch_size = settings.CONVTASNET_BATCH_SIZE
+        for first in range(0, len(mixtures), batch_size):
+            batch = mixtures[first : first + batch_size]
+            for index, estimates in enumerate(
+                separate_batch(separator, batch), start=first
+            ):
+                # Mixtures alternate between microphone 1 and microphone 2
+                separation.append(
+                    separation_metrics(estimates, references[index], index % 2)
+                )
+
+        results.append(
+            {
+                "fidelity": tier,
+                "time_per_scene": np.mean(times),
+                "mean_rt60_error": np.mean(rt60_errors),
+                "mean_input_si_snr": np.mean(input_si_snrs),
+                "mean_sdr": np.mean([sdr for sdr, _ in separation]),
+                "mean_sir": np.mean([sir for _, sir in separation]),
+            }
+        )
+        record_computation_time(f"fidelity-{tier}", num_scenes, np.sum(times))
+
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False))
+    return df
+
+
+def benchmark_asr(
+    file_path=settings.LIBRIDIALOGUE_PATH + "/test-clean/8k/reverb-dual",
+    batch_sizes=(1, settings.ANALYZE_ASR_BATCH_SIZE),
+    num_files=None,
+):
+    """
+    Whisper throughput in files per second on a dataset directory, once per batch
+    size. A batch size of 1 corresponds to transcribing file by file.
+    """
+    from libridialogue.util.analyze import transcribe
+
+    file_list = [file for file in list_files(file_path) if file != ".DS_Store"]
+    if num_files is not None:
+        file_list = file_list[:num_files]
+
+    # Load and warm up the model
+    transcribe(file_path, file_list[:1], batch_size=1)
+
+    throughputs = {}
+    for batch_size in batch_sizes:
+        start = time()
+        transcribe(file_path, file_list, batch_size=batch_size)
+        asr_time = time() - start
+        throughputs[batch_size] = len(file_list) / asr_time
+        print(f"batch size {batch_size}: {throughputs[batch_size]:.2f} files/s")
+        record_computation_time(f"asr-batch-{batch_size}", len(file_list), asr_time)
+
+    return throughputs
+
+
+def benchmark_asteroid(
+    libridialogue_path=settings.LIBRIDIALOGUE_PATH + "/test-clean",
+    rates=(8000, 16000),
+    batch_sizes=(1, settings.CONVTASNET_BATCH_SIZE),
+):
+    """
+    ConvTasNet separation time of the reverb-dual sets, once per batch size.
+    A batch size of 1 corresponds to separating file by file.
+    """
+    from libridialogue.util.separate_asteroid import (
+        CONVTASNET_MODELS,
+        separate_asteroid,
+    )
+
+    times = {}
+    for rate in rates:
+        dataset_path = f"{libridialogue_path}/{rate_label(rate)}/reverb-dual"
+        file_count = len(
+            [file for file in list_files(dataset_path) if file.endswith(".wav")]
+        )
+        for batch_size in batch_sizes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                start = time()
+                separate_asteroid(
+                    dataset_path,
+                    f"{tmp_dir}/convtasnet",
+                    rate,
+                    model=CONVTASNET_MODELS[rate],
+                    batch_size=batch_size,
+                )
+                times[(rate, batch_size)] = time() - start
+            print(
+                f"{rate_label(rate)} batch size {batch_size}: "
+                f"{times[(rate, batch_size)]:.2f}s for {file_count} files"
+            )
+            record_computation_time(
+                f"convtasnet-{rate_label(rate)}-batch-{batch_size}",
+                file_count,
+                times[(rate, batch_size)],
+            )
+
+    return times
+
+
+if __name__ == "__main__":
+    benchmark_clean_mix(settings.LIBRISPEECH_PATH + "/test-clean")
+    benchmark_convolution()
+    benchmark_fidelity()
+    benchmark_asr()
+    benchmark_asteroid()
@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import fft
+
+
+def _solve(matrix, rhs):
+    """
+    Batched linear solve, singular systems fall back to the pseudo-inverse
+    """
+    try:
+        return np.linalg.solve(matrix, rhs)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(matrix) @ rhs
+
+
+def bss_eval(estimates, references, targets, filter_length=512):
+    """
+    Vectorised BSS-Eval source-to-distortion, source-to-interference and
+    source-to-artifact ratios, as bss_eval_sources with time-invariant distortion
+    filters of filter_length taps.
+    All estimates of an item share the references, so the correlations of the
+    references and the Gram matrix of their delayed copies are computed once per
+    item and reused for every estimate.
+
+    Args:
+    - estimates (np.ndarray): (batch, estimates, samples)
+    - references (np.ndarray): (batch, references, samples)
+    - targets (np.ndarray): (batch, estimates) index of the reference each
+      estimate is scored against, the other references are interferers
+    - filter_length (int): Number of taps of the distortion filters
+
+    Returns:
+    - tuple: (sdr, sir, sar), each (batch, estimates) in dB
+    """
+    estimates = np.asarray(estimates, dtype=np.float32)
+    references = np.asarray(references, dtype=np.float32)
+    targets = np.asarray(targets)
+    batch, num_estimates, length = estimates.shape
+    num_references = references.shape[1]
+    taps = filter_length
+    out_length = length + taps - 1
+    # Long enough that correlations up to the filter length do not wrap around
+    n_fft = fft.next_fast_len(out_length, real=True)
+
+    ref_spectra = fft.rfft(references, n_fft, axis=-1)
+    est_spectra = fft.rfft(estimates, n_fft, axis=-1)
+
+    # corr[b, i, j, m] = sum_n s_i[n] s_j[n + m]
+    corr = fft.irfft(
+        np.conj(ref_spectra)[:, :, None] * ref_spectra[:, None], n_fft, axis=-1
+    )
+    # gram_blocks[b, i, j, k, l] = sum_n s_i[n - k] s_j[n - l]
+    lags = (np.arange(taps)[:, None] - np.arange(taps)[None]) % n_fft
+    gram_blocks = corr[..., lags]
+    gram = gram_blocks.transpose(0, 1, 3, 2, 4).reshape(
+        batch, num_references * taps, num_references * taps
+    )
+
+    # cross[b, e, j, l] = sum_n s_j[n - l] e[n]
+    cross = fft.irfft(
+        np.conj(ref_spectra)[:, None] * est_spectra[:, :, None], n_fft, axis=-1
+    )[..., :taps]
+
+    items = np.arange(batch)[:, None]
+    estimate_indices = np.arange(num_estimates)[None]
+
+    # Projection on the delayed copies of the target
+    target_coefficients = _solve(
+        gram_blocks[items, targets, targets],
+        cross[items, estimate_indices, targets][..., None],
+    )[..., 0]
+    target_proj = fft.irfft(
+        ref_spectra[items, targets] * fft.rfft(target_coefficients, n_fft, axis=-1),
+        n_fft,
+        axis=-1,
+    )[..., :out_length]
+
+    # Projection on the delayed copies of all references
+    coefficients = _solve(
+        gram, cross.reshape(batch, num_estimates, -1).transpose(0, 2, 1)
+    )
+    coefficients = coefficients.reshape(
+        batch, num_references, taps, num_estimates
+    ).transpose(0, 3, 1, 2)
+    sources_proj = fft.irfft(
+        (ref_spectra[:, None] * fft.rfft(coefficients, n_fft, axis=-1)).sum(axis=2),
+        n_fft,
+        axis=-1,
+    )[..., :out_length]
+
+    padded = np.zeros((batch, num_estimates, out_length), dtype=np.float32)
+    padded[..., :length] = estimates
+
+    e_interf = sources_proj - target_proj
+    e_artif = padded - sources_proj
+
+    def energy(signal):
+        return np.einsum("bet,bet->be", signal, signal)
+
+    with np.errstate(divide="ignore"):
+        sdr = 10 * np.log10(energy(target_proj) / energy(padded - target_proj))
+        sir = 10 * np.log10(energy(target_proj) / energy(e_interf))
+        sar = 10 * np.log10(energy(sources_proj) / energy(e_artif))
+
+    return (
+        sdr.astype(np.float32),
+        sir.astype(np.float32),
+        sar.astype(np.float32),
+    )
@@ -0,0 +1,286 @@
+import copy
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+import optuna
+
+from libridialogue import settings
+from libridialogue.generate import rate_label
+from libridialogue.shards import list_files
+from libridialogue.util.analyze import evaluate_bss
+from libridialogue.util.seeding import derive_seed
+from libridialogue.util.separate_cosy import pair_jobs, process_pair
+
+METRICS = ["sdr", "sir", "sar"]
+PARAMETER_GROUPS = ["compressor_parameters", "gate_parameters"]
+
+# Parameters with this many steps are continuous, the others are switches and
+# modes of the plugins and keep their initial value
+CONTINUOUS_STEPS = 2147483647
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def parameter_name(group, parameter):
+    return f"{group.split('_')[0]}/{parameter['name']}"
+
+
+def searchable_parameters(config):
+    """
+    Returns:
+    - list: (group, parameter) of the continuous plugin parameters
+    """
+    return [
+        (group, parameter)
+        for group in PARAMETER_GROUPS
+        for parameter in config[group]
+        if parameter["numSteps"] == CONTINUOUS_STEPS
+    ]
+
+
+def snap(value, step):
+    """
+    Round a parameter value to the search grid
+    """
+    return min(max(round(round(value / step) * step, 6), 0.0), 1.0)
+
+
+class ResultCache:
+    """
+    BSS-Eval results of a pair separated with a config, stored in SQLite and
+    shared by the parallel trials
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "config_hash TEXT, pair TEXT, sdr REAL, sir REAL, sar REAL, "
+                "PRIMARY KEY (config_hash, pair))"
+            )
+            self.connection.commit()
+
+    def get(self, config_hash, pair):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sdr, sir, sar FROM results "
+                "WHERE config_hash = ? AND pair = ?",
+                (config_hash, "_".join(pair)),
+            ).fetchone()
+        return None if row is None else dict(zip(METRICS, row))
+
+    def put(self, config_hash, pair, values):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (config_hash, "_".join(pair)) + tuple(values[m] for m in METRICS),
+            )
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def evaluate_config(
+    config_path, config_key, pairs, input_dataset_path, target_path, rate, cache
+):
+    """
+    Separate the pairs with a config and score both outputs of every pair with
+    BSS-Eval. Pairs already evaluated with the same config are taken from the
+    cache.
+
+    Returns:
+    - list: Dicts of the mean sdr, sir and sar of the pairs
+    """
+    missing = [pair for pair in pairs if cache.get(config_key, pair) is None]
+
+    if missing:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            errors = []
+            for pair in missing:
+                errors.extend(
+                    process_pair(
+                        pair,
+                        input_dataset_path,
+                        tmp_dir,
+                        rate,
+                        config_path,
+                        None,
+                        settings.COSY_TIMEOUT,
+                    )
+                )
+            if errors:
+                raise RuntimeError(f"cosy failed for {errors[0]}")
+
+            files = [
+                name
+                for id_1, id_2 in missing
+                for name in (f"{id_1}_{id_2}.wav", f"{id_2}_{id_1}.wav")
+            ]
+            # The trials run in parallel already
+            metrics = evaluate_bss(tmp_dir, target_path, files, num_workers=1)
+
+        for id_1, id_2 in missing:
+            values = [
+                metrics[name]
+                for name in (f"{id_1}_{id_2}.wav", f"{id_2}_{id_1}.wav")
+                if name in metrics
+            ]
+            if not values:
+                raise RuntimeError(f"No references for {id_1}_{id_2}")
+            cache.put(
+                config_key,
+                (id_1, id_2),
+                dict(zip(METRICS, np.mean(values, axis=0).tolist())),
+            )
+
+    return [cache.get(config_key, pair) for pair in pairs]
+
+
+def optimize_cosy(
+    input_dataset_path=settings.LIBRIDIALOGUE_PATH + "/test-clean/8k/reverb-dual",
+    target_path=settings.LIBRIDIALOGUE_PATH + "/test-clean/8k/reverb-solo",
+    rate=8000,
+    n_trials=settings.COSY_OPTIMIZATION_TRIALS,
+    n_jobs=settings.COSY_OPTIMIZATION_N_JOBS,
+    num_pairs=settings.COSY_OPTIMIZATION_PAIRS,
+    num_steps=settings.COSY_OPTIMIZATION_STEPS,
+    metric=settings.COSY_OPTIMIZATION_METRIC,
+    output_path=settings.COSY_OPTIMIZATION_PATH,
+):
+    """
+    Search the continuous compressor and gate parameters of the cosy separator
+    with CMA-ES. Every trial separates a fixed subset of pairs in num_steps
+    parts, a trial whose running mean falls behind the median of earlier trials
+    is pruned after a part. n_jobs trials run in parallel.
+    The study is stored in study.sqlite and study.csv in output_path, the best
+    config is written to best_config.json.
+
+    Returns:
+    - dict: The best config
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown optimization metric {metric}")
+    step = float(settings.COSY_OPTIMIZATION_PARAMETER_STEP_SIZE)
+
+    os.makedirs(os.path.join(output_path, "configs"), exist_ok=True)
+    with open(settings.COSY_OPTIMIZATION_INITIAL_CONFIG_FILE) as f:
+        initial_config = json.load(f)
+    parameters = searchable_parameters(initial_config)
+    initial_params = {
+        parameter_name(group, parameter): snap(parameter["value"], step)
+        for group, parameter in parameters
+    }
+
+    # The evaluation subset is the same for every trial
+    file_list = [f for f in list_files(input_dataset_path) if f.endswith(".wav")]
+    pairs = pair_jobs(file_list)
+    pairs = random.Random(settings.RANDOM_SEED).sample(
+        pairs, min(num_pairs, len(pairs))
+    )
+    part_size = math.ceil(len(pairs) / num_steps)
+    parts = [pairs[i : i + part_size] for i in range(0, len(pairs), part_size)]
+
+    cache = ResultCache(os.path.join(output_path, "results.sqlite"))
+
+    def objective(trial):
+        config = copy.deepcopy(initial_config)
+        for group in PARAMETER_GROUPS:
+            for parameter in config[group]:
+                if parameter["numSteps"] == CONTINUOUS_STEPS:
+                    parameter["value"] = trial.suggest_float(
+                        parameter_name(group, parameter), 0.0, 1.0, step=step
+                    )
+
+        config_key = config_hash(config)
+        config_path = os.path.join(output_path, "configs", f"{config_key}.json")
+        if not os.path.exists(config_path):
+            # Parallel trials may write the same config
+            partial_path = f"{config_path}.{trial.number}.partial"
+            with open(partial_path, "w") as f:
+                json.dump(config, f, indent=2)
+            os.replace(partial_path, config_path)
+        trial.set_user_attr("config_hash", config_key)
+
+        scores = []
+        for number, part in enumerate(parts):
+            results = evaluate_config(
+                config_path,
+                config_key,
+                part,
+                input_dataset_path,
+                target_path,
+                rate,
+                cache,
+            )
+            scores.extend(result[metric] for result in results)
+            trial.report(float(np.mean(scores)), number)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        return float(np.mean(scores))
+
+    study = optuna.create_study(
+        study_name=f"cosy-{rate_label(rate)}-{metric}",
+        storage=f"sqlite:///{os.path.join(output_path, 'study.sqlite')}",
+        load_if_exists=True,
+        direction="maximize",
+        sampler=optuna.samplers.CmaEsSampler(
+            x0=initial_params,
+            seed=derive_seed(settings.RANDOM_SEED, "optimize-cosy"),
+            with_margin=True,
+        ),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1),
+    )
+    # A resumed study only runs the missing trials, a new one starts with the
+    # initial config as baseline
+    remaining = n_trials - len(study.trials)
+    if not study.trials:
+        study.enqueue_trial(initial_params)
+    try:
+        if remaining > 0:
+            study.optimize(
+                objective, n_trials=remaining, n_jobs=n_jobs, catch=(RuntimeError,)
+            )
+    finally:
+        cache.close()
+        study.trials_dataframe().to_csv(
+            os.path.join(output_path, "study.csv"), index=False
+        )
+
+    completed = [
+        trial
+        for trial in study.trials
+        if trial.state == optuna.trial.TrialState.COMPLETE
+    ]
+    if not completed:
+        raise RuntimeError(
+            f"No trial of the study in {output_path} completed, see study.csv for "
+            "the failed and pruned trials"
+        )
+
+    best_hash = study.best_trial.user_attrs["config_hash"]
+    with open(os.path.join(output_path, "configs", f"{best_hash}.json")) as f:
+        best_config = json.load(f)
+    with open(os.path.join(output_path, "best_config.json"), "w") as f:
+        json.dump(best_config, f, indent=2)
+
+    print(
+        f"Best {metric}: {study.best_value:.2f} dB in trial {study.best_trial.number}"
+    )
+    return best_config
+
+
+if __name__ == "__main__":
+    optimize_cosy()
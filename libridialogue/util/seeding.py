@@ -0,0 +1,29 @@
+import random
+import hashlib
+import numpy as np
+import pyroomacoustics as pra
+
+
+def derive_seed(*keys):
+    """
+    Derive a 32 bit seed from a sequence of keys, e.g. the global random seed and
+    the index of a pair
+    """
+    key = ":".join(str(k) for k in keys)
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big")
+
+
+def seed_all(seed):
+    """
+    Seed the random number generators used during generation, including the
+    generators of the pyroomacoustics ray tracer
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    # Newer pyroomacoustics versions draw from a package-wide numpy generator
+    # besides the C++ generator of libroom
+    if hasattr(pra, "random") and hasattr(pra.random, "seed"):
+        pra.random.seed(numpy=seed, libroom=seed)
+    else:
+        pra.libroom.set_rng_seed(seed)
@@ -1,6 +1,7 @@
 import soundfile as sf
 import numpy as np
 import tempfile
+import torch
 from asteroid.models import BaseModel
 import os
 from tqdm import tqdm
@@ -8,6 +9,13 @@ from time import time
 import pandas as pd
 
 from libridialogue import settings
+from libridialogue.shards import list_files, open_file
+from libridialogue.util.audio_io import BackgroundWriter
+
+CONVTASNET_MODELS = {
+    8000: "JorisCos/ConvTasNet_Libri2Mix_sepnoisy_8k",
+    16000: "JorisCos/ConvTasNet_Libri2Mix_sepnoisy_16k",
+}
 
 
 # merge the separated signals into a single mono audio file and write it as a temporary wav file
@@ -23,11 +31,70 @@ def merge_and_write(separated_signals, sr=8000):
     return temp_file_path
 
 
+def length_buckets(lengths, batch_size, max_padding):
+    """
+    Group items into batches of similar length. The longest item of a batch is at
+    most max_padding (relative) longer than the shortest one.
+
+    Args:
+    - lengths (dict): Item -> length in samples
+
+    Returns:
+    - list: Batches as lists of items
+    """
+    batches = []
+    batch = []
+    for item in sorted(lengths, key=lengths.get):
+        if batch and (
+            len(batch) == batch_size
+            or lengths[item] > lengths[batch[0]] * (1 + max_padding)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(item)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def separate_batch(model, mixtures):
+    """
+    Separate a batch of mono mixtures of different lengths in one forward pass.
+    The mixtures are zero padded, the padding is masked out of the estimates and
+    the loudness of every estimate is matched to its mixture, like
+    BaseModel.separate does for a single mixture.
+
+    Returns:
+    - list: (sources, samples) arrays, one per mixture
+    """
+    lengths = torch.tensor([len(mixture) for mixture in mixtures])
+    batch = torch.zeros(len(mixtures), 1, int(lengths.max()))
+    for index, mixture in enumerate(mixtures):
+        batch[index, 0, : len(mixture)] = torch.from_numpy(mixture)
+
+    with torch.inference_mode():
+        batch = batch.to(next(model.parameters()).device)
+        estimates = model.forward_wav(batch)
+        lengths = lengths.to(estimates.device)
+        mask = torch.arange(batch.shape[-1], device=estimates.device) < lengths[:, None]
+        estimates = estimates * mask[:, None]
+        scale = batch.abs().sum(dim=(1, 2)) / estimates.abs().sum(dim=(1, 2))
+        estimates = estimates * scale[:, None, None]
+
+    estimates = estimates.cpu().numpy()
+    return [
+        estimate[:, :length] for estimate, length in zip(estimates, lengths.tolist())
+    ]
+
+
 def separate_asteroid(
     input_dataset_path,
     output_dataset_path,
     rate,
     model="JorisCos/ConvTasNet_Libri2Mix_sepnoisy_16k",
+    batch_size=settings.CONVTASNET_BATCH_SIZE,
+    max_padding=settings.CONVTASNET_MAX_PADDING,
+    num_threads=settings.CONVTASNET_NUM_THREADS,
 ):
     # check if the output directory exists
     if os.path.exists(output_dataset_path):
@@ -44,32 +111,39 @@ def separate_asteroid(
 
     start = time()
 
-    model = BaseModel.from_pretrained(model)
+    if num_threads is not None:
+        torch.set_num_threads(int(num_threads))
 
-    # iterate over all .wav files in the dataset path
-    for file in tqdm(os.listdir(input_dataset_path)):
-        if file.endswith(".wav"):
-            id_1 = file.split("_")[0]
-            id_2 = file.split("_")[1].split(".")[0]
-
-            # You can pass a NumPy array:
-            mixture, _ = sf.read(
-                input_dataset_path + "/" + file,
-                dtype="float32",
-                always_2d=True,
-            )
-
-            # Soundfile returns the mixture as shape (time, channels),
-            # and Asteroid expects (batch, channels, time)
-            mixture = mixture.transpose()
-            mixture = mixture.reshape(1, mixture.shape[0], mixture.shape[1])
-
-            signals = model.separate(mixture)[0]
-
-            save_file1 = f"{output_dataset_path}/{id_1}_{id_2}-1.wav"
-            sf.write(save_file1, signals[0], rate)
-            save_file2 = f"{output_dataset_path}/{id_1}_{id_2}-2.wav"
-            sf.write(save_file2, signals[1], rate)
+    model = BaseModel.from_pretrained(model)
+    model.eval()
+
+    files = [file for file in list_files(input_dataset_path) if file.endswith(".wav")]
+    lengths = {
+        file: sf.info(open_file(input_dataset_path, file)).frames for file in files
+    }
+    batches = length_buckets(lengths, batch_size, max_padding)
+
+    # the outputs are written while the next batch is separated
+    with BackgroundWriter() as writer, tqdm(total=len(files)) as progress:
+        for batch in batches:
+            mixtures = []
+            for file in batch:
+                # Soundfile returns the mixture as shape (time, channels)
+                mixture, _ = sf.read(
+                    open_file(input_dataset_path, file),
+                    dtype="float32",
+                    always_2d=True,
+                )
+                mixtures.append(mixture.mean(axis=1))
+
+            for file, signals in zip(batch, separate_batch(model, mixtures)):
+                id_1 = file.split("_")[0]
+                id_2 = file.split("_")[1].split(".")[0]
+                save_file1 = f"{output_dataset_path}/{id_1}_{id_2}-1.wav"
+                writer.write(save_file1, signals[0], rate)
+                save_file2 = f"{output_dataset_path}/{id_1}_{id_2}-2.wav"
+                writer.write(save_file2, signals[1], rate)
+            progress.update(len(batch))
 
     end = time()
 
@@ -1,11 +1,13 @@
 import os
 import subprocess
+import tempfile
 from tqdm import tqdm
 import pandas as pd
 from time import time
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from libridialogue import settings
+from libridialogue.shards import list_files, local_path
 
 SEPARATOR_BASE_COMMAND = [
     "./bin/cosy_speaker_separator",
@@ -16,24 +18,33 @@ SEPARATOR_BASE_COMMAND = [
 ]
 
 
-def process_file(
-    file1,
-    input_dataset_path,
-    output_dataset_path,
-    rate,
-    config_file,
-    rms_threshold,
-):
-    id_1 = file1.split("_")[0]
-    id_2 = file1.split("_")[1].split(".")[0]
-    file2 = f"{id_2}_{id_1}.wav"
+def pair_jobs(file_list):
+    """
+    One job per pair, the file list contains both orderings {a}_{b}.wav and
+    {b}_{a}.wav of every pair
+
+    Returns:
+    - list: (id_1, id_2) tuples
+    """
+    pairs = []
+    seen = set()
+    for file in file_list:
+        id_1 = file.split("_")[0]
+        id_2 = file.split("_")[1].split(".")[0]
+        if frozenset((id_1, id_2)) not in seen:
+            seen.add(frozenset((id_1, id_2)))
+            pairs.append((id_1, id_2))
+    return pairs
+
+
+def separator_command(input_1, input_2, output, rate, config_file, rms_threshold):
     command = SEPARATOR_BASE_COMMAND + [
         "-i",
-        os.path.join(input_dataset_path, file1),
+        input_1,
         "-j",
-        os.path.join(input_dataset_path, file2),
+        input_2,
         "-o",
-        os.path.join(output_dataset_path, f"{id_1}_{id_2}.wav"),
+        output,
         "-f",
         str(rate),
         "--config",
@@ -42,7 +53,78 @@ def process_file(
     # Include rms_threshold if provided
     if rms_threshold is not None:
         command += ["-r", str(rms_threshold)]
-    subprocess.call(command, text=True)
+    return command
+
+
+def run_separator(command, timeout):
+    """
+    Returns:
+    - str: Error message, None on success
+    """
+    try:
+        completed = subprocess.run(
+            command, capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return f"timed out after {timeout}s"
+    except OSError as error:
+        return str(error)
+    if completed.returncode != 0:
+        return f"exit code {completed.returncode}: {completed.stderr.strip()[-500:]}"
+    return None
+
+
+def process_pair(
+    pair,
+    input_dataset_path,
+    output_dataset_path,
+    rate,
+    config_file,
+    rms_threshold,
+    timeout,
+):
+    """
+    Separate both channels of a pair, one separator process per channel. The
+    inputs are extracted once for both runs, outputs that exist from an
+    interrupted run are kept.
+
+    Returns:
+    - list: Error messages of the failed outputs
+    """
+    id_1, id_2 = pair
+    errors = []
+    # The separator reads from paths, files inside shards are extracted first
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inputs = {
+            name: local_path(input_dataset_path, name, tmp_dir)
+            for name in (f"{id_1}_{id_2}.wav", f"{id_2}_{id_1}.wav")
+        }
+        missing = [
+            (first, second)
+            for first, second in ((id_1, id_2), (id_2, id_1))
+            if not os.path.exists(
+                os.path.join(output_dataset_path, f"{first}_{second}.wav")
+            )
+        ]
+        for first, second in missing:
+            output = os.path.join(output_dataset_path, f"{first}_{second}.wav")
+            command = separator_command(
+                inputs[f"{first}_{second}.wav"],
+                inputs[f"{second}_{first}.wav"],
+                output,
+                rate,
+                config_file,
+                rms_threshold,
+            )
+            error = run_separator(command, timeout)
+            if error is None and not os.path.exists(output):
+                error = "no output written"
+            if error is not None:
+                # A killed separator may leave a truncated output behind
+                if os.path.exists(output):
+                    os.remove(output)
+                errors.append(f"{first}_{second}.wav: {error}")
+    return errors
 
 
 def separate_cosy(
@@ -51,13 +133,19 @@ def separate_cosy(
     rate,
     config_file=settings.COSY_CONFIG_FILE,
     rms_threshold=None,
+    num_workers=settings.COSY_NUM_WORKERS,
+    timeout=settings.COSY_TIMEOUT,
 ):
     # Check if the output directory exists
     if os.path.exists(output_dataset_path):
         print("Dataset already separated by cosy, skipping...")
         return
-    else:
-        os.makedirs(output_dataset_path)
+
+    # The outputs are written to a partial directory that is renamed once every
+    # output exists, a failed run keeps it and the next run only separates the
+    # missing outputs
+    partial_path = output_dataset_path + ".partial"
+    os.makedirs(partial_path, exist_ok=True)
 
     # Load or create the computation times DataFrame
     if os.path.exists(settings.COMPUTATION_TIMES_CSV):
@@ -67,28 +155,28 @@ def separate_cosy(
 
     start = time()
 
-    # Build a list of unique files to process
-    file_list = [f for f in os.listdir(input_dataset_path) if f.endswith(".wav")]
+    # Every pair is listed twice, as {a}_{b}.wav and {b}_{a}.wav
+    file_list = [f for f in list_files(input_dataset_path) if f.endswith(".wav")]
+    pairs = pair_jobs(file_list)
 
-    # Prepare partial function with fixed arguments
-    process_file_partial = partial(
-        process_file,
+    process_partial = partial(
+        process_pair,
         input_dataset_path=input_dataset_path,
-        output_dataset_path=output_dataset_path,
+        output_dataset_path=partial_path,
         rate=rate,
         config_file=config_file,
         rms_threshold=rms_threshold,
+        timeout=timeout,
     )
 
-    # Use ProcessPoolExecutor for parallel processing
-    with ProcessPoolExecutor() as executor:
-        list(
-            tqdm(
-                executor.map(process_file_partial, file_list),
-                total=len(file_list),
-                desc="Processing files",
-            )
-        )
+    # The workers only wait for the separator processes, threads are sufficient
+    errors = []
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(process_partial, pair) for pair in pairs]
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Processing pairs"
+        ):
+            errors.extend(future.result())
 
     end = time()
 
@@ -104,3 +192,9 @@ def separate_cosy(
     )
     df = pd.concat([df, result], ignore_index=True)
     df.to_csv(settings.COMPUTATION_TIMES_CSV, index=False)
+
+    if errors:
+        for error in errors[:20]:
+            print(f"cosy failed for {error}")
+        raise RuntimeError(f"cosy failed for {len(errors)} of {len(pairs) * 2} outputs")
+    os.replace(partial_path, output_dataset_path)
@@ -1,7 +1,4 @@
-import soundfile as sf
 import numpy as np
-import librosa
-import tempfile
 from modelscope.pipelines import pipeline
 from modelscope.utils.constant import Tasks
 import os
@@ -10,19 +7,13 @@ from time import time
 import pandas as pd
 
 from libridialogue import settings
-
-
-# merge the separated signals into a single mono audio file and write it as a temporary wav file
-def merge_and_write(separated_signals, sr=8000):
-    # merge the separated signals into a single mono audio file
-    merged_signal = np.sum(separated_signals, axis=0)
-
-    # write the merged signal to a temporary wav file
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-        temp_file_path = temp_file.name
-        sf.write(temp_file_path, merged_signal, sr)
-
-    return temp_file_path
+from libridialogue.shards import list_files, open_file
+from libridialogue.util.audio_io import (
+    BackgroundWriter,
+    encode_wav,
+    read_audio,
+    resample,
+)
 
 
 def separate_mossformer2(
@@ -54,53 +45,45 @@ def separate_mossformer2(
     )
 
     # iterate over all .wav files in the dataset path
-    for file1 in tqdm(os.listdir(input_dataset_path)):
-        if file1 in files_to_skip:
-            continue
-        if file1.endswith(".wav"):
-            id_1 = file1.split("_")[0]
-            id_2 = file1.split("_")[1].split(".")[0]
-            file2 = f"{id_2}_{id_1}.wav"
-
-            if not save_all_outputs:
+    with BackgroundWriter() as writer:
+        for file1 in tqdm(list_files(input_dataset_path)):
+            if file1 in files_to_skip:
+                continue
+            if file1.endswith(".wav"):
+                id_1 = file1.split("_")[0]
+                id_2 = file1.split("_")[1].split(".")[0]
+                file2 = f"{id_2}_{id_1}.wav"
+
+                # Both orderings of a pair have the same mixture, it is
+                # separated once
                 files_to_skip.add(file2)
 
-            audio, sr = librosa.load(input_dataset_path + "/" + file1, sr=None)
+                audio_1, rate_1 = read_audio(open_file(input_dataset_path, file1))
+                audio_2, rate_2 = read_audio(open_file(input_dataset_path, file2))
+                mixture = resample(audio_1, rate_1, 8000) + resample(
+                    audio_2, rate_2, 8000
+                )
 
-            temp_file_path = merge_and_write(
-                [
-                    librosa.resample(
-                        librosa.load(f"{input_dataset_path}/{file1}", sr=None)[0],
-                        orig_sr=sr,
-                        target_sr=8000,
-                    ),
-                    librosa.resample(
-                        librosa.load(f"{input_dataset_path}/{file2}", sr=None)[0],
-                        orig_sr=sr,
-                        target_sr=8000,
-                    ),
-                ]
-            )
-
-            # Run the separation
-            result = separation_pipe(temp_file_path)
+                # Run the separation, the pipeline reads the wav from memory
+                result = separation_pipe(encode_wav(mixture, 8000))
 
-            # Save the separated signals
-            signals = result["output_pcm_list"]
-
-            if not save_all_outputs:
-                save_file1 = f"{output_dataset_path}/{id_1}_{id_2}.wav"
-                sf.write(save_file1, np.frombuffer(signals[0], dtype=np.int16), 8000)
-                save_file2 = f"{output_dataset_path}/{id_2}_{id_1}.wav"
-                sf.write(save_file2, np.frombuffer(signals[1], dtype=np.int16), 8000)
-            else:
-                save_file1 = f"{output_dataset_path}/{id_1}_{id_2}-1.wav"
-                sf.write(save_file1, np.frombuffer(signals[0], dtype=np.int16), 8000)
-                save_file2 = f"{output_dataset_path}/{id_1}_{id_2}-2.wav"
-                sf.write(save_file2, np.frombuffer(signals[1], dtype=np.int16), 8000)
+                # Save the separated signals
+                signals = [
+                    np.frombuffer(signal, dtype=np.int16)
+                    for signal in result["output_pcm_list"]
+                ]
 
-            # remove the temporary file
-            os.remove(temp_file_path)
+                if not save_all_outputs:
+                    save_file1 = f"{output_dataset_path}/{id_1}_{id_2}.wav"
+                    writer.write(save_file1, signals[0], 8000)
+                    save_file2 = f"{output_dataset_path}/{id_2}_{id_1}.wav"
+                    writer.write(save_file2, signals[1], 8000)
+                else:
+                    for first, second in ((id_1, id_2), (id_2, id_1)):
+                        save_file1 = f"{output_dataset_path}/{first}_{second}-1.wav"
+                        writer.write(save_file1, signals[0], 8000)
+                        save_file2 = f"{output_dataset_path}/{first}_{second}-2.wav"
+                        writer.write(save_file2, signals[1], 8000)
 
     end = time()
 
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def content_hash(source):
+    """
+    SHA-256 of the audio content of a file path or file object
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    else:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Transcripts stored in a SQLite database, keyed by the hash of the audio
+    content, the ASR model and the decoding options. Renamed or copied files hit
+    the same entry, changed audio or another model miss it.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            "audio_hash TEXT, model TEXT, options TEXT, text TEXT, "
+            "PRIMARY KEY (audio_hash, model, options))"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _options(options):
+        return json.dumps(options, sort_keys=True)
+
+    def get(self, audio_hash, model, options):
+        """
+        Returns:
+        - str: The cached transcript, None on a miss
+        """
+        row = self.connection.execute(
+            "SELECT text FROM transcripts "
+            "WHERE audio_hash = ? AND model = ? AND options = ?",
+            (audio_hash, model, self._options(options)),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put_many(self, entries, model, options):
+        """
+        Store (audio_hash, text) pairs in one transaction
+        """
+        options = self._options(options)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)",
+            [(audio_hash, model, options, text) for audio_hash, text in entries],
+        )
+        self.connection.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.connection.execute(
+                "SELECT COUNT(*) FROM transcripts"
+            ).fetchone()[0],
+        }
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from libridialogue.librispeech.download import download
+
+
+def build_archive(package, num_files=20, file_size=8192):
+    """
+    A gzipped tar archive laid out like the LibriSpeech archives, with random
+    contents so that it does not compress
+    """
+    files = {
+        f"19/198/19-198-{index:04d}.flac": os.urandom(file_size)
+        for index in range(num_files)
+    }
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(f"LibriSpeech/{package}/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue(), files
+
+
+class ArchiveServer:
+    """
+    Serves an archive and its md5sum.txt with Range support. While budget is
+    set, the responses of the archive are cut off once that many bytes of it
+    have been sent in total, like a connection that is gone for good. With
+    drop_every, every response is cut off after that many bytes as well.
+    """
+
+    def __init__(self, package, archive, checksums=True):
+        self.budget = None
+        self.drop_every = None
+        self.requests = []
+        files = {f"/{package}.tar.gz": archive}
+        if checksums:
+            md5 = hashlib.md5(archive).hexdigest()
+            files["/md5sum.txt"] = f"{md5} {package}.tar.gz\n".encode()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get("Range")))
+                if self.path not in files:
+                    self.send_error(404)
+                    return
+                data = files[self.path]
+                start = 0
+                if self.headers.get("Range"):
+                    start = int(self.headers["Range"][len("bytes=") : -1])
+                    if start >= len(data):
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                data = data[start:]
+                if self.path.endswith(".tar.gz"):
+                    if server.drop_every is not None:
+                        data = data[: server.drop_every]
+                    if server.budget is not None:
+                        data = data[: server.budget]
+                        server.budget -= len(data)
+                    self.close_connection = True
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def archive_ranges(self):
+        """
+        Range headers of the requests of the archive
+        """
+        return [
+            range_header
+            for path, range_header in self.requests
+            if path.endswith(".tar.gz")
+        ]
+
+
+def test_download_extracts_and_verifies(tmp_path):
+    archive, files = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive) as server:
+        download(["test-clean"], str(tmp_path), server.base_url)
+
+    for name, data in files.items():
+        assert (tmp_path / "test-clean" / name).read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["test-clean"]
+
+
+def test_download_resumes_dropped_connections(tmp_path):
+    archive, files = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive) as server:
+        # Every connection is cut off, but each one makes progress
+        server.drop_every = 4096
+        download(["test-clean"], str(tmp_path), server.base_url)
+        ranges = server.archive_ranges()
+        assert ranges[0] is None and len(ranges) > 1
+
+    for name, data in files.items():
+        assert (tmp_path / "test-clean" / name).read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["test-clean"]
+
+
+def test_download_restarts_without_keeping_the_archive(tmp_path):
+    archive, files = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive) as server:
+        # The connection is lost for good, the first process gives up after its
+        # retries
+        server.budget = len(archive) // 2
+        with pytest.raises(IOError, match="connection closed"):
+            download(["test-clean"], str(tmp_path), server.base_url)
+        assert not (tmp_path / ".test-clean.tar.gz.partial").exists()
+        # Members extracted before the connection was lost are not extracted again
+        progress = (tmp_path / ".test-clean.progress").read_text().splitlines()
+        assert 0 < len(progress) < len(files)
+
+        # A restarted process downloads the archive from the start
+        server.requests.clear()
+        server.budget = None
+        download(["test-clean"], str(tmp_path), server.base_url)
+        assert server.archive_ranges() == [None]
+
+    for name, data in files.items():
+        assert (tmp_path / "test-clean" / name).read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["test-clean"]
+
+
+def test_download_with_spool_continues_after_restart(tmp_path):
+    archive, files = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive) as server:
+        server.budget = len(archive) // 2
+        with pytest.raises(IOError, match="connection closed"):
+            download(["test-clean"], str(tmp_path), server.base_url, spool=True)
+        received = os.path.getsize(tmp_path / ".test-clean.tar.gz.partial")
+        assert 0 < received < len(archive)
+
+        # A restarted process continues at the end of the spool file
+        server.requests.clear()
+        server.budget = None
+        download(["test-clean"], str(tmp_path), server.base_url, spool=True)
+        assert server.archive_ranges() == [f"bytes={received}-"]
+
+    for name, data in files.items():
+        assert (tmp_path / "test-clean" / name).read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["test-clean"]
+
+
+def test_download_archive_restarts_without_keeping_the_archive(tmp_path):
+    archive, files = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive) as server:
+        server.budget = len(archive) // 2
+        with pytest.raises(IOError, match="connection closed"):
+            download(["test-clean"], str(tmp_path), server.base_url, extract=False)
+        # Only the uncompressed tar is written, never the compressed bytes
+        assert sorted(os.listdir(tmp_path)) == ["test-clean.tar.partial"]
+
+        server.requests.clear()
+        server.budget = None
+        download(["test-clean"], str(tmp_path), server.base_url, extract=False)
+        assert server.archive_ranges() == [None]
+
+    with tarfile.open(tmp_path / "test-clean.tar") as tar:
+        for name, data in files.items():
+            member = tar.extractfile(f"LibriSpeech/test-clean/{name}")
+            assert member.read() == data
+    assert sorted(os.listdir(tmp_path)) == ["test-clean.tar"]
+
+
+def test_download_without_checksums_fails(tmp_path):
+    archive, _ = build_archive("test-clean")
+    with ArchiveServer("test-clean", archive, checksums=False) as server:
+        with pytest.raises(IOError, match="No checksum"):
+            download(["test-clean"], str(tmp_path), server.base_url)
+        assert server.archive_ranges() == []
+
+        download(["test-clean"], str(tmp_path), server.base_url, verify=False)
+    assert (tmp_path / "test-clean").is_dir()
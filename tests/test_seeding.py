@@ -0,0 +1,28 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from libridialogue.simulate_dialogue_reverb import compute_scene_rirs, sample_scene
+from libridialogue.util.seeding import derive_seed, seed_all
+
+
+def rir_hash(seed, fidelity):
+    seed_all(seed)
+    rirs = compute_scene_rirs(sample_scene(), 8000, fidelity)
+    digest = hashlib.sha256()
+    for mic_rirs in rirs:
+        for rir in mic_rirs:
+            digest.update(np.asarray(rir, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def test_derive_seed_is_32_bit():
+    seed = derive_seed(42, "pair", 7)
+    assert seed == derive_seed(42, "pair", 7)
+    assert 0 <= seed < 2**32
+
+
+@pytest.mark.parametrize("fidelity", ["hybrid", "full"])
+def test_ray_tracing_is_deterministic(fidelity):
+    assert rir_hash(5, fidelity) == rir_hash(5, fidelity)